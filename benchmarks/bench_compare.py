@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+'''Benchmark "preserve compare --relpath" on pairs of synthetic inventory
+   CSVs of increasing size. The time per row should stay roughly constant
+   as the number of rows grows, i.e. the comparison scales linearly.
+
+   python benchmarks/bench_compare.py [--rows 10000 100000 1000000 10000000]
+'''
+
+import argparse
+import contextlib
+import csv
+import os
+import tempfile
+import time
+
+from preserve.compare import compare
+
+
+def write_manifest(path, rows, changed=0):
+    '''Write a synthetic inventory CSV, with the sizes of the last "changed"
+       files altered so that they appear as differences.'''
+    with open(path, 'w', newline='') as handle:
+        writer = csv.writer(handle)
+        writer.writerow(['PATH', 'DIRECTORY', 'FILENAME', 'BYTES', 'MD5'])
+        for n in range(rows):
+            directory = f'/archive/batch/dir{n // 1000:05}'
+            filename = f'file{n:08}.tif'
+            size = n + 1 if n < rows - changed else n + 2
+            writer.writerow([f'{directory}/{filename}', directory, filename, size, f'{n:032x}'])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--rows', type=int, nargs='+', default=[10_000, 100_000, 1_000_000])
+    args = parser.parse_args()
+
+    print(f"{'ROWS':>10} {'SECONDS':>10} {'USEC/ROW':>10}")
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for rows in args.rows:
+            first = os.path.join(tmpdir, 'first.csv')
+            second = os.path.join(tmpdir, 'second.csv')
+            write_manifest(first, rows)
+            write_manifest(second, rows, changed=10)
+
+            compare_args = argparse.Namespace(first=first, other=[second], relpath=True)
+            with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+                start = time.perf_counter()
+                compare(compare_args)
+                elapsed = time.perf_counter() - start
+            print(f"{rows:>10} {elapsed:>10.2f} {elapsed / (2 * rows) * 1e6:>10.2f}")
+
+
+if __name__ == '__main__':
+    main()
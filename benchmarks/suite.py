@@ -0,0 +1,290 @@
+#!/usr/bin/env python3
+'''Benchmark suite for the hot paths of the preserve and partition tools.
+   Synthetic data is generated in a temporary directory (no network access
+   or real collections are needed): a tree of many tiny files, a deeply
+   nested tree, a few large sparse files, CSV and TSM manifests and a BagIt
+   bag. Each benchmark is run several times and the best and median times
+   are recorded, with throughput where it applies.
+
+   Results are written as JSON so that they can be kept for each release
+   and compared, e.g.
+
+   python -m benchmarks.suite -o benchmarks/results/1.0.json
+   python -m benchmarks.suite --baseline benchmarks/results/1.0.json
+
+   It is run as a module from the root of the checkout, so that the
+   partition package (which is not installed) can be imported.
+
+   With --baseline, any benchmark slower than the baseline by more than
+   --threshold percent is reported as a regression and the exit status is 1.
+'''
+
+import argparse
+import contextlib
+import csv
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+from partition.classes import FileSet
+from preserve import version
+from preserve.asset import BUFFER_SIZE, calculate_etag, calculate_hashes
+from preserve.bagcheck import bagcheck
+from preserve.compare import compare
+from preserve.inventory import inventory
+from preserve.manifest import Manifest
+from preserve.verify import verify
+
+ALGORITHMS = ['md5', 'sha1', 'sha256']
+MB = 1024 ** 2
+
+
+# === SYNTHETIC DATA =========================================================
+
+def make_tiny_tree(root, files, per_dir=100):
+    '''Many small files (0-4 KiB) in directories of per_dir files each'''
+    for n in range(files):
+        directory = os.path.join(root, f'dir{n // per_dir:05}')
+        if n % per_dir == 0:
+            os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, f'abc-{n % 97}-file{n:07}.tif'), 'wb') as handle:
+            handle.write(os.urandom(n % 4096))
+
+
+def make_deep_tree(root, depth, files_per_level=2):
+    '''A single chain of nested directories with a few files at each level'''
+    directory = root
+    for level in range(depth):
+        directory = os.path.join(directory, f'level{level:03}')
+        os.makedirs(directory)
+        for n in range(files_per_level):
+            with open(os.path.join(directory, f'file{n}.txt'), 'w') as handle:
+                handle.write(f'{level}-{n}\n')
+
+
+def make_sparse_files(root, count, size):
+    '''A few large files that occupy (almost) no space on disk'''
+    os.makedirs(root)
+    for n in range(count):
+        with open(os.path.join(root, f'huge{n}.bin'), 'wb') as handle:
+            handle.truncate(size)
+
+
+def write_csv_manifest(path, rows, root='/archive/batch'):
+    with open(path, 'w', newline='') as handle:
+        writer = csv.writer(handle)
+        writer.writerow(['PATH', 'DIRECTORY', 'FILENAME', 'BYTES', 'MD5'])
+        for n in range(rows):
+            directory = f'{root}/dir{n // 1000:05}'
+            filename = f'file{n:08}.tif'
+            writer.writerow([f'{directory}/{filename}', directory, filename, n, f'{n:032x}'])
+
+
+def write_tsm_manifest(path, rows):
+    with open(path, 'w') as handle:
+        handle.write('IBM Tivoli Storage Manager\n')
+        for n in range(rows):
+            handle.write(f'Normal File-->    {n:,} \\\\archive\\batch\\dir{n // 1000:05}'
+                         f'\\file{n:08}.tif [Sent]\n')
+
+
+def make_bag(root, files):
+    '''A BagIt bag of small files, with its md5 and sha256 manifests, and
+       an inventory CSV of the same files'''
+    data = os.path.join(root, 'data')
+    make_tiny_tree(data, files)
+    lines = {'md5': [], 'sha256': []}
+    rows = []
+    for directory, _, filenames in os.walk(data):
+        for filename in sorted(filenames):
+            path = os.path.join(directory, filename)
+            digests = calculate_hashes(path, ['md5', 'sha256'])
+            relpath = os.path.relpath(path, root)
+            for alg in lines:
+                lines[alg].append(f'{digests[alg]}  {relpath}\n')
+            rows.append([path, directory, filename, os.path.getsize(path),
+                         digests['md5'], digests['sha256']])
+    for alg, manifest in lines.items():
+        with open(os.path.join(root, f'manifest-{alg}.txt'), 'w') as handle:
+            handle.writelines(manifest)
+    inventory_csv = f'{root}.csv'
+    with open(inventory_csv, 'w', newline='') as handle:
+        writer = csv.writer(handle)
+        writer.writerow(['PATH', 'DIRECTORY', 'FILENAME', 'BYTES', 'MD5', 'SHA256'])
+        writer.writerows(rows)
+    return inventory_csv
+
+
+def tree_size(root):
+    return sum(os.path.getsize(os.path.join(d, f)) for d, _, fs in os.walk(root) for f in fs)
+
+
+# === BENCHMARKS =============================================================
+
+def inventory_args(path, outfile, algorithms):
+    return argparse.Namespace(
+        batch='benchmark', path=path, outfile=outfile, existing=None,
+        algorithms=algorithms, label=None, mount=None, workers=1,
+        buffer_size=BUFFER_SIZE, cache=None, verify_cache=False, progress='none'
+        )
+
+
+def benchmarks(data, tmpdir):
+    '''Return a list of (name, function, items, bytes) tuples, where items
+       and bytes are the amount of work done by one call of the function'''
+    outfile = os.path.join(tmpdir, 'inventory.csv')
+
+    def run_inventory(path, algorithms):
+        def run():
+            if os.path.exists(outfile):
+                os.remove(outfile)
+            inventory(inventory_args(path, outfile, algorithms))
+        return run
+
+    huge = [os.path.join(data['sparse'], f) for f in sorted(os.listdir(data['sparse']))]
+    sparse_bytes = sum(os.path.getsize(f) for f in huge)
+    tiny_bytes = tree_size(data['tiny'])
+
+    return [
+        ('calculate_hashes sparse', lambda: [calculate_hashes(f, ALGORITHMS) for f in huge],
+         len(huge), sparse_bytes),
+        ('calculate_etag sparse', lambda: [calculate_etag(f, 8 * MB) for f in huge],
+         len(huge), sparse_bytes),
+        ('inventory tiny', run_inventory(data['tiny'], ','.join(ALGORITHMS)),
+         data['tiny_files'], tiny_bytes),
+        ('inventory tiny stat-only', run_inventory(data['tiny'], 'none'),
+         data['tiny_files'], 0),
+        ('inventory deep', run_inventory(data['deep'], 'md5'),
+         data['deep_files'], 0),
+        ('manifest csv', lambda: sum(1 for a in Manifest(data['csv'])),
+         data['rows'], os.path.getsize(data['csv'])),
+        ('manifest tsm', lambda: sum(1 for a in Manifest(data['tsm'])),
+         data['rows'], os.path.getsize(data['tsm'])),
+        ('verify csv', lambda: verify(argparse.Namespace(
+            first=data['csv'], second=data['csv_other'], progress='none')),
+         2 * data['rows'], 0),
+        ('compare csv tsm', lambda: compare(argparse.Namespace(
+            first=data['csv'], other=[data['csv_other'], data['tsm']], relpath=False)),
+         3 * data['rows'], 0),
+        ('bagcheck dir', lambda: bagcheck(argparse.Namespace(
+            inventory=data['bag_inventory'], bag=data['bag'])),
+         data['bag_files'], 0),
+        ('partition_by', lambda: FileSet.from_csv(data['csv']).partition_by(
+            r"^([a-z]+?)-(\d+?)[-_][^.]+?\.\S+?$", '/partitioned'),
+         data['rows'], 0),
+        ]
+
+
+def run_benchmark(func, repeat):
+    times = []
+    with open(os.devnull, 'w') as devnull, \
+            contextlib.redirect_stdout(devnull), contextlib.redirect_stderr(devnull):
+        for _ in range(repeat):
+            start = time.perf_counter()
+            func()
+            times.append(time.perf_counter() - start)
+    return times
+
+
+def compare_results(results, baseline, threshold):
+    '''Return a list of the benchmarks that are slower than in the baseline'''
+    regressions = []
+    for name, result in results.items():
+        before = baseline['results'].get(name)
+        if before:
+            change = 100 * (result['best'] - before['best']) / before['best']
+            result['change_percent'] = round(change, 1)
+            if change > threshold:
+                regressions.append(name)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('-o', '--output', help='Write the results to this JSON file')
+    parser.add_argument('-b', '--baseline', help='Results (JSON) to compare against')
+    parser.add_argument('-t', '--threshold', type=float, default=10,
+                        help='Percentage slowdown reported as a regression (default 10)')
+    parser.add_argument('-r', '--repeat', type=int, default=3)
+    parser.add_argument('-k', '--select', help='Run only benchmarks whose names contain this')
+    parser.add_argument('--tiny-files', type=int, default=5000)
+    parser.add_argument('--depth', type=int, default=200)
+    parser.add_argument('--huge-files', type=int, default=2)
+    parser.add_argument('--huge-size', type=int, default=256, help='Size of huge files in MiB')
+    parser.add_argument('--rows', type=int, default=100_000, help='Rows in each manifest')
+    args = parser.parse_args()
+
+    parameters = {k: v for k, v in vars(args).items()
+                  if k in ('repeat', 'tiny_files', 'depth', 'huge_files', 'huge_size', 'rows')}
+    results = {}
+    with tempfile.TemporaryDirectory() as tmpdir:
+        print(f"Generating synthetic data in {tmpdir}...", file=sys.stderr)
+        data = {'tiny': os.path.join(tmpdir, 'tiny'),
+                'deep': os.path.join(tmpdir, 'deep'),
+                'sparse': os.path.join(tmpdir, 'sparse'),
+                'csv': os.path.join(tmpdir, 'manifest.csv'),
+                'csv_other': os.path.join(tmpdir, 'other.csv'),
+                'tsm': os.path.join(tmpdir, 'manifest.tsm'),
+                'bag': os.path.join(tmpdir, 'bag'),
+                'tiny_files': args.tiny_files,
+                'deep_files': 2 * args.depth,
+                'bag_files': min(args.tiny_files, 1000),
+                'rows': args.rows}
+        make_tiny_tree(data['tiny'], args.tiny_files)
+        make_deep_tree(data['deep'], args.depth)
+        make_sparse_files(data['sparse'], args.huge_files, args.huge_size * MB)
+        write_csv_manifest(data['csv'], args.rows)
+        write_csv_manifest(data['csv_other'], args.rows, root='/copy/of/batch')
+        write_tsm_manifest(data['tsm'], args.rows)
+        data['bag_inventory'] = make_bag(data['bag'], data['bag_files'])
+
+        print(f"{'BENCHMARK':<28} {'BEST S':>10} {'MEDIAN S':>10} {'ITEMS/S':>12} {'MB/S':>10}")
+        for name, func, items, bytes in benchmarks(data, tmpdir):
+            if args.select and args.select not in name:
+                continue
+            times = run_benchmark(func, args.repeat)
+            best = min(times)
+            results[name] = {'best': round(best, 6),
+                             'median': round(statistics.median(times), 6),
+                             'times': [round(t, 6) for t in times],
+                             'items': items,
+                             'bytes': bytes,
+                             'items_per_sec': round(items / best, 1) if best else None,
+                             'mb_per_sec': round(bytes / best / 10**6, 1) if bytes and best else None}
+            rate = '' if results[name]['mb_per_sec'] is None else results[name]['mb_per_sec']
+            print(f"{name:<28} {best:>10.3f} {results[name]['median']:>10.3f} "
+                  f"{results[name]['items_per_sec']:>12} {rate:>10}")
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline) as handle:
+            baseline = json.load(handle)
+        regressions = compare_results(results, baseline, args.threshold)
+        print(f"\nCompared with {args.baseline} (version {baseline.get('version')}):")
+        for name, result in results.items():
+            if 'change_percent' in result:
+                flag = '  REGRESSION' if name in regressions else ''
+                print(f"  {name:<28} {result['change_percent']:>+7.1f}%{flag}")
+
+    if args.output:
+        report = {'version': version,
+                  'timestamp': datetime.now().isoformat(timespec='seconds'),
+                  'python': platform.python_version(),
+                  'platform': platform.platform(),
+                  'parameters': parameters,
+                  'results': results}
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, 'w') as handle:
+            json.dump(report, handle, indent=2)
+            handle.write('\n')
+
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
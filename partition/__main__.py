@@ -8,6 +8,7 @@ import shutil
 import sys
 from pathlib import Path
 
+from preserve.progress import Progress
 from preserve.utils import header
 
 from .classes import FileSet
@@ -55,6 +56,14 @@ def parse_args():
         help='Path to csv file',
         )
 
+    parser.add_argument(
+        '-p', '--progress',
+        choices=['text', 'json', 'none'],
+        help='Report progress as text, JSON lines, or not at all',
+        action='store',
+        default='none'
+        )
+
     parser.add_argument(
         '-v', '--version',
         action='version',
@@ -147,19 +156,21 @@ def main():
         """ (7) Move, copy, or print """
         relpaths = []
         logging.info(f"Partitioning files ({args.mode} mode)...")
+        progress = Progress('Files partitioned', total_files=len(mapping),
+                            total_bytes=fileset.bytes, mode=args.progress)
         for n, (source, destination) in enumerate(mapping.items(), 1):
             logging.info(f"  {n}. {source} -> {destination}")
-            if args.mode == 'dryrun':
-                continue
-            else:
+            if args.mode != 'dryrun':
                 os.makedirs(os.path.dirname(destination), exist_ok=True)
                 if args.mode == 'copy':
                     shutil.copyfile(source, destination)
                 elif args.mode == 'move':
                     shutil.move(source, destination)
 
-            relpaths.append((source, destination))
+                relpaths.append((source, destination))
+            progress.update(bytes=fileset[source].bytes)
 
+        progress.close()
         logging.info("Partitioning complete.\n")
 
         """ (8) Record results """
@@ -3,6 +3,8 @@ import os
 import re
 from collections import UserDict, namedtuple
 
+from preserve.utils import iter_files
+
 Asset = namedtuple('Asset', 'filename md5 bytes')
 
 
@@ -21,15 +23,10 @@ class FileSet(UserDict):
 
     @classmethod
     def from_filesystem(cls, root):
+        # sizes come from the stat results of the walk; files are never opened
         data = dict()
-        for directory, subdirs, files in os.walk(root):
-            for filename in files:
-                if filename.startswith("."):
-                    continue
-                filepath = os.path.join(directory, filename)
-                bytes = os.path.getsize(filepath)
-                asset = Asset(filename, None, bytes)
-                data[filepath] = asset
+        for entry in iter_files(root, prune_hidden_dirs=False):
+            data[entry.path] = Asset(entry.name, None, entry.stat().st_size)
         return cls(data)
 
     @property
@@ -2,18 +2,80 @@
 # -*- coding: utf-8 -*-
 
 import argparse
+import cProfile
 import sys
 
-from . import version
+from . import instrument, version
 from .annotate import annotate
+from .asset import BUFFER_SIZE
 from .bagcheck import bagcheck
 from .bytecount import bytecount
+from .cache import CACHE_PATH
 from .compare import compare
 from .inventory import inventory
 from .utils import header, subheader
 from .verify import verify
 
 
+def positive_int(value):
+    '''Argument type for sizes and counts, which must be at least 1.'''
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(f'{value} is not a positive number')
+    return number
+
+
+def add_cache_arguments(parser):
+    '''Add the options controlling the persistent hash cache to a parser.'''
+    parser.add_argument(
+        '--cache',
+        help=f'Path to the hash cache database (default {CACHE_PATH})',
+        action='store',
+        default=CACHE_PATH
+        )
+
+    parser.add_argument(
+        '--no-cache',
+        help='Do not read or write the hash cache',
+        action='store_const',
+        const=None,
+        dest='cache'
+        )
+
+    parser.add_argument(
+        '--verify-cache',
+        help='Hash every file and report any that differ from the cache',
+        action='store_true'
+        )
+
+
+def add_sort_arguments(parser):
+    '''Add the options for comparing manifests larger than memory to a parser.'''
+    parser.add_argument(
+        '--memory-limit',
+        help='Sort the manifests on disk, holding about this many MB in memory',
+        metavar='MB',
+        type=int,
+        action='store'
+        )
+
+    parser.add_argument(
+        '--tmpdir',
+        help='Directory for the temporary files of --memory-limit (default system temp dir)',
+        action='store'
+        )
+
+
+def add_progress_arguments(parser):
+    '''Add the option controlling progress reporting to a parser.'''
+    parser.add_argument(
+        '--progress',
+        help='Report progress as text, JSON lines, or not at all',
+        choices=['text', 'json', 'none'],
+        default='text'
+        )
+
+
 def main():
     '''Parse args and set the chosen sub-command as the default function.'''
 
@@ -37,6 +99,21 @@ def main():
         version=version
         )
 
+    parser.add_argument(
+        '--profile',
+        help='Report the time spent in each stage of processing (default table)',
+        nargs='?',
+        const='table',
+        choices=['table', 'json']
+        )
+
+    parser.add_argument(
+        '--cprofile',
+        help='Write cProfile statistics to the given file',
+        metavar='PATH',
+        action='store'
+        )
+
     subparsers.required = True
 
     # parser for the "annotate" sub-command
@@ -64,6 +141,29 @@ def main():
         action='store'
         )
 
+    annotate_parser.add_argument(
+        '-w', '--workers',
+        help='Number of threads searching for files concurrently (default 1)',
+        type=int,
+        default=1
+        )
+
+    annotate_parser.add_argument(
+        '--by-checksum',
+        help='Find files by the stored MD5 or SHA256 of each row instead of by filename, '
+             'using an index of the checksums of all the files kept in the hash cache',
+        action='store_true'
+        )
+
+    annotate_parser.add_argument(
+        '--resume',
+        help='Resume an interrupted run, keeping the rows already in the output file',
+        action='store_true'
+        )
+
+    add_cache_arguments(annotate_parser)
+    add_progress_arguments(annotate_parser)
+
     annotate_parser.set_defaults(func=annotate)
 
     # parser for the "bytecount" sub-command
@@ -110,6 +210,20 @@ def main():
         action='store'
         )
 
+    bagcheck_parser.add_argument(
+        '--fixity',
+        help='Read and hash every payload file, checking it against all of the '
+             'manifests in the bag and against the inventory (if given)',
+        action='store_true'
+        )
+
+    bagcheck_parser.add_argument(
+        '-w', '--workers',
+        help='Number of files to hash concurrently, for a bag directory (default 1)',
+        type=int,
+        default=1
+        )
+
     bagcheck_parser.set_defaults(func=bagcheck)
 
     # parser for the "compare" sub-command
@@ -125,6 +239,8 @@ def main():
         action='store_true'
         )
 
+    add_sort_arguments(comp_parser)
+
     comp_parser.add_argument('first', help='first file')
     comp_parser.add_argument(
         'other', nargs='+',
@@ -163,7 +279,7 @@ def main():
 
     inv_parser.add_argument(
         '-a', '--algorithms',
-        help='hash algorithms to run',
+        help='hash algorithms to run, or "none" to read only the file metadata',
         action='store'
         )
 
@@ -181,6 +297,25 @@ def main():
         default=None
         )
 
+    inv_parser.add_argument(
+        '-w', '--workers',
+        help='Number of files to hash concurrently',
+        action='store',
+        type=int,
+        default=1
+        )
+
+    inv_parser.add_argument(
+        '--buffer-size',
+        help=f'Size in bytes of the read buffer used for hashing (default {BUFFER_SIZE})',
+        action='store',
+        type=positive_int,
+        default=BUFFER_SIZE
+        )
+
+    add_cache_arguments(inv_parser)
+    add_progress_arguments(inv_parser)
+
     inv_parser.set_defaults(func=inventory)
 
     # parser for the "verify" sub-command
@@ -208,6 +343,22 @@ def main():
         action='store_true'
         )
 
+    ver_parser.add_argument(
+        '--report',
+        help='Write the differences found to a CSV or JSON file',
+        metavar='PATH',
+        action='store'
+        )
+
+    ver_parser.add_argument(
+        '--report-format',
+        help='Format of the report (default from the file extension, or csv)',
+        choices=['csv', 'json']
+        )
+
+    add_sort_arguments(ver_parser)
+    add_progress_arguments(ver_parser)
+
     ver_parser.add_argument('first', help='first file or path')
     ver_parser.add_argument('second', help='second file or path')
     ver_parser.set_defaults(func=verify)
@@ -216,7 +367,20 @@ def main():
     args = parser.parse_args()
     sys.stderr.write(header("preserve.py"))
     sys.stderr.write(subheader(args.func.__name__))
-    result = args.func(args)
+    if args.profile:
+        instrument.enable()
+    profiler = cProfile.Profile() if args.cprofile else None
+    if profiler is not None:
+        profiler.enable()
+    try:
+        result = args.func(args)
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(args.cprofile)
+        if instrument.TIMINGS is not None:
+            sys.stderr.write(instrument.TIMINGS.report(args.profile))
+            instrument.disable()
 
     if result:
         sys.stderr.write(result)
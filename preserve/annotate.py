@@ -2,8 +2,11 @@ import csv
 import os
 import sys
 
-from .asset import Asset
-from .manifest import Manifest
+from .asset import MB, calculate_hashes
+from .cache import SEARCHABLE, HashCache, open_cache
+from .progress import Progress
+from .utils import iter_files, ordered_map
+from .writer import InventoryWriter, recover
 
 ALGS = ['md5', 'sha1', 'sha256']
 
@@ -13,73 +16,219 @@ FIELDNAMES = ['BATCH', 'PATH', 'DIRECTORY', 'RELPATH', 'FILENAME', 'EXTENSION',
 
 
 def read_csv(filepath):
-    '''Read asset data from CSV file'''
-    result = []
-    with open(filepath) as handle:
-        reader = csv.DictReader(handle)
+    '''Read asset data from CSV file, generating the rows one at a time;
+       any fields missing from short rows are blank'''
+    with open(filepath, newline='') as handle:
+        reader = csv.DictReader(handle, restval='')
         for row in reader:
             row.setdefault('storagepath', '')
             row.setdefault('storageprovider', '')
-            result.append(row)
-    return result
+            yield row
+
+
+def count_lines(filepath):
+    '''Quickly count the lines in a file, i.e. (roughly) the rows of a CSV'''
+    count = 0
+    with open(filepath, 'rb') as handle:
+        for block in iter(lambda: handle.read(MB), b''):
+            count += block.count(b'\n')
+    return count
+
+
+def count_rows(filepath):
+    '''Count the data rows already written to an output CSV'''
+    with open(filepath, newline='') as handle:
+        return sum(1 for row in csv.DictReader(handle))
 
 
 def scan_filesystem(root):
-    '''Create lookup of filepaths by filname in asset directory'''
+    '''Create lookup of (filepath, stat) pairs by filename in asset directory'''
     result = {}
-    for currentdir, subdirs, files in os.walk(root):
-        for file in files:
-            result.setdefault(file, []).append(os.path.join(currentdir, file))
+    for entry in iter_files(root, prune_hidden_files=False, prune_hidden_dirs=False):
+        result.setdefault(entry.name, []).append((entry.path, entry.stat()))
     return result
 
 
-def examine_matching_file(filename, root, row, file_index):
-    '''Locate file match in the index and annotate the spreadsheet row'''
-    updated = row
-    for path in file_index.get(filename, []):
-        asset = Asset().from_filesystem(path, root, label=None, mount_path=None, *ALGS)
-        for algorithm in ALGS:
-            storedhash = row[algorithm.upper()]
-            calculated = getattr(asset, algorithm)
-            if storedhash == '':
-                updated[algorithm.upper()] = calculated
-            elif calculated != storedhash:
-                break
-            else:
-                sys.stderr.write(f" => {storedhash} == {calculated}\n")
-                continue
-        sys.stderr.write(" => Match!\n")
+def get_digests(path, stat, algorithms, cache=None):
+    '''Return the requested digests of a file, from the cache if possible,
+       keeping the path of the file in the cache up to date'''
+    digests = None
+    if cache is not None and not cache.verify:
+        digests = cache.lookup(stat, algorithms, path)
+    if digests is None:
+        digests = calculate_hashes(path, algorithms)
+        if cache is not None:
+            cache.store(path, stat, digests)
+    return digests
+
+
+def examine_matching_file(filename, root, row, file_index, cache=None):
+    '''Locate file match in the index and annotate the spreadsheet row. Only
+       candidates of the right size are considered. If there are several,
+       each is checked against just one of the stored checksums, so that
+       non-matching files are read with a single algorithm, and the remaining
+       checksums are calculated only for the file that matches; a single
+       candidate is read once, for all of the checksums.'''
+    size = row.get('BYTES') or ''
+    size = int(size) if size.isdigit() else None
+    stored = [alg for alg in ALGS if row.get(alg.upper())]
+    candidates = [(path, stat) for path, stat in file_index.get(filename, [])
+                  if size is None or stat.st_size == size]
+    check = ALGS if len(candidates) == 1 else stored[:1]
+    for path, stat in candidates:
+        digests = get_digests(path, stat, check, cache) if check else {}
+        if any(digests[alg] != row[alg.upper()].lower() for alg in check if alg in stored):
+            continue
+        others = [alg for alg in ALGS if alg not in digests]
+        if others:
+            digests.update(get_digests(path, stat, others, cache))
+        if any(digests[alg] != row[alg.upper()].lower() for alg in others if alg in stored):
+            continue
+        updated = dict(row)
+        for alg, value in digests.items():
+            updated[alg.upper()] = value
         updated['PATH'] = path
         return updated
-    sys.stderr.write("No match!\n")
+    return row
+
+
+def index_checksums(root, cache, workers=1, mode='text'):
+    '''Make sure that the cache holds the checksums of every file under the
+       root, hashing only the files that are new or have changed since they
+       were cached. Returns the number of files.'''
+    def check(entry):
+        stat = entry.stat()
+        get_digests(entry.path, stat, ALGS, cache)
+        return stat.st_size
+
+    progress = Progress('Files indexed', mode=mode)
+    files = iter_files(root, prune_hidden_files=False, prune_hidden_dirs=False)
+    for size in ordered_map(check, files, workers):
+        progress.update(bytes=size)
+    progress.close()
+    return progress.files
+
+
+def examine_by_checksum(root, row, cache):
+    '''Find the file under the root with the stored MD5 or SHA256 of the
+       row in the cache (see index_checksums), and annotate the row, filling
+       in any blank checksums from the cache.'''
+    prefix = os.path.join(os.path.abspath(root), '')
+    size = row.get('BYTES') or ''
+    size = int(size) if size.isdigit() else None
+    for alg in SEARCHABLE:
+        digest = row.get(alg.upper()) or ''
+        if digest == '':
+            continue
+        for path, device, inode, cached_size, mtime_ns in cache.find(alg, digest.lower()):
+            if not path.startswith(prefix) or (size is not None and cached_size != size):
+                continue
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            if (stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime_ns) != \
+                    (device, inode, cached_size, mtime_ns):
+                # the file has changed since it was indexed
+                continue
+            digests = cache.lookup(stat, ALGS)
+            if digests is None or \
+                    any((row.get(a.upper()) or '').lower() not in ('', digests[a]) for a in ALGS):
+                continue
+            updated = dict(row)
+            for a, value in digests.items():
+                updated[a.upper()] = value
+            updated['PATH'] = path
+            return updated
     return row
 
 
 def annotate(args):
-    '''Read CSV and scan filesystem to fill in blanks in the data'''
+    '''Read CSV and scan filesystem to fill in blanks in the data. The CSV is
+       streamed through a pool of workers that look for the files, and the
+       annotated rows are written in the same order as the input, so that an
+       interrupted run can be resumed from the rows already written.'''
+    workers = getattr(args, 'workers', None) or 1
     sys.stderr.write(f"Running with the following arguments:\n")
     sys.stderr.write(f" - CSV to annotate:     {args.inventory}\n")
     sys.stderr.write(f" - Directory to search: {args.root}\n")
-    sys.stderr.write(f" - Write results to:    {args.output}\n\n")
-
-    spreadsheet = read_csv(args.inventory)
-    sys.stderr.write(f"Read {len(spreadsheet)} lines from CSV\n")
-
-    file_index = scan_filesystem(args.root)
-    sys.stderr.write(f"Created index of {len(file_index)} filenames\n")
-
-    handle = open(args.output, 'w', 1)
-    writer = csv.DictWriter(handle, fieldnames=FIELDNAMES, extrasaction='ignore')
-    writer.writeheader()
-
-    for n, row in enumerate(spreadsheet, 1):
-        filename = row['FILENAME']
-        if row['PATH'] != '' or row['storagepath'] != '':
-            sys.stderr.write(f"{n}. Skipping completed row for {filename}\n")
-            # writer.writerow(row)
-        else:
-            sys.stderr.write(f"{n}. Searching for a local path to {filename} ...\n")
-            annotated = examine_matching_file(filename, args.root, row, file_index)
-            writer.writerow(annotated)
+    sys.stderr.write(f" - Write results to:    {args.output}\n")
+    sys.stderr.write(f" - Worker threads:      {workers}\n\n")
+
+    total = max(count_lines(args.inventory) - 1, 0)
+    sys.stderr.write(f"Read {total} lines from CSV\n")
+
+    # rows already written by an interrupted run are skipped; completed rows
+    # are not written, so the output has one row for each row searched for.
+    # An empty output (from a run interrupted before its header was written)
+    # is started again.
+    resume = getattr(args, 'resume', False) and os.path.isfile(args.output) and \
+        os.path.getsize(args.output) > 0
+    done = 0
+    if resume:
+        try:
+            recover(args.output)
+        except ValueError as e:
+            return f"ERROR: {e}\n"
+        done = count_rows(args.output)
+        sys.stderr.write(f"Resuming after {done} rows already in {args.output}\n")
+
+    cache = open_cache(args)
+    if getattr(args, 'by_checksum', False):
+        # without the persistent cache, the index only lasts for this run
+        if cache is None:
+            cache = HashCache(':memory:')
+        count = index_checksums(args.root, cache, workers, getattr(args, 'progress', 'text'))
+        sys.stderr.write(f"Indexed the checksums of {count} files\n")
+
+        def search(row):
+            return examine_by_checksum(args.root, row, cache)
+    else:
+        file_index = scan_filesystem(args.root)
+        sys.stderr.write(f"Created index of {len(file_index)} filenames\n")
+
+        def search(row):
+            return examine_matching_file(row['FILENAME'], args.root, row, file_index, cache)
+
+    if resume:
+        handle = open(args.output, 'a', newline='')
+        writer = InventoryWriter(handle, FIELDNAMES, path=args.output, rows=done,
+                                 extrasaction='ignore')
+    else:
+        handle = open(args.output, 'w', newline='')
+        writer = InventoryWriter(handle, FIELDNAMES, path=args.output, extrasaction='ignore')
+        writer.writeheader()
+
+    progress = Progress('Rows checked', total_files=total, mode=getattr(args, 'progress', 'text'))
+
+    def rows_to_search():
+        skipped = 0
+        for row in read_csv(args.inventory):
+            if row['PATH'] != '' or row['storagepath'] != '':
+                # skip completed rows
+                progress.update()
+            elif skipped < done:
+                skipped += 1
+                progress.update()
+            else:
+                yield row
 
-    handle.close()
+    # at most a few rows per worker are in flight, so memory use does not
+    # grow with the size of the CSV
+    matched = 0
+    try:
+        for annotated in ordered_map(search, rows_to_search(), workers):
+            writer.writerow(annotated)
+            if annotated['PATH'] != '':
+                matched += 1
+            progress.update()
+    except BaseException:
+        # keep the rows completed so far, and the journal, for resuming
+        writer.checkpoint()
+        raise
+
+    writer.close()
+    progress.close()
+    sys.stderr.write(f"Found local paths for {matched} rows\n")
+    if cache is not None:
+        cache.close()
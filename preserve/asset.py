@@ -1,9 +1,68 @@
 import hashlib
 import os
+import sys
+import threading
+import time
 from datetime import datetime as dt
+from stat import S_ISREG
 
+from . import instrument
+
+MB = 1024 ** 2
 GB = 1024 ** 3
 CHUNK_SIZE = 4 * GB
+BUFFER_SIZE = 4 * MB
+
+# read buffers are allocated once per thread and reused for every file
+_buffers = threading.local()
+
+# the attributes stored in a slot of every Asset; any others are kept
+# in a dictionary that is only created when needed
+FIELDS = ('batch', 'path', 'directory', 'relpath', 'filename', 'extension',
+          'bytes', 'mtime', 'moddate', 'md5', 'etag', 'sha1', 'sha256',
+          'storageprovider', 'storagelocation')
+
+
+class EtagHash():
+    """
+    Incremental AWS etag calculation, with the same update() and hexdigest()
+    interface as the hashlib objects, so that the etag can be computed from
+    the same buffers as the other digests in a single read of the file.
+    """
+    def __init__(self, chunk_size=CHUNK_SIZE):
+        self.chunk_size = chunk_size
+        self.parts = []
+        self.remaining = 0
+
+    def update(self, data):
+        data = memoryview(data)
+        while len(data) > 0:
+            if self.remaining == 0:
+                self.parts.append(hashlib.md5())
+                self.remaining = self.chunk_size
+            portion = data[:self.remaining]
+            self.parts[-1].update(portion)
+            self.remaining -= len(portion)
+            data = data[len(portion):]
+
+    def hexdigest(self):
+        if not self.parts:
+            # for zero byte files, just return the MD5 sum of an empty string
+            return hashlib.md5(b'').hexdigest()
+        elif len(self.parts) == 1:
+            return self.parts[0].hexdigest()
+        else:
+            digests = hashlib.md5(b''.join(m.digest() for m in self.parts))
+            return f'{digests.hexdigest()}-{len(self.parts)}'
+
+
+def new_hash(algorithm, chunk_size=CHUNK_SIZE):
+    '''Return a hash object for the named algorithm, where "etag" is accepted
+       alongside the hashlib algorithms'''
+    if algorithm == 'etag':
+        return EtagHash(chunk_size)
+    else:
+        return getattr(hashlib, algorithm)()
 
 
 def calculate_etag(path, chunk_size):
@@ -12,70 +71,122 @@ def calculate_etag(path, chunk_size):
     the specified chunk size, the hash of all the chunk hashes concatenated
     together, followed by the number of chunks.
     """
-    file_size = os.path.getsize(path)
-    if file_size == 0:
-        # for zero byte files, just return the MD5 sum of an empty string
-        return hashlib.md5(b'').hexdigest()
-    else:
-        md5s = []
-        with open(path, 'rb') as handle:
-            if chunk_size < GB:
-                for data in chunked(handle, chunk_size):
-                    md5s.append(hashlib.md5(data))
-            else:
-                # Python doesn't like reading more than 1GB from a file at a time.
-                # To get around this, read 1GB at a time and assemble the portions
-                # into the final md5sum.
-                if chunk_size % GB != 0:
-                    raise ConfigException('Chunk sizes >1GB must be multiples of 1GB')
-                portions_per_chunk = chunk_size // GB
-                md5sum = None
-                for i, data in enumerate(chunked(handle, GB), 1):
-                    if md5sum is None:
-                        md5sum = hashlib.md5()
-                    md5sum.update(data)
-                    if i % portions_per_chunk == 0:
-                        md5s.append(md5sum)
-                        md5sum = None
-                else:
-                    # check to see if we have a pending md5sum
-                    # after the last iteration of the loop
-                    if md5sum is not None:
-                        md5s.append(md5sum)
-
-        if len(md5s) == 1:
-            return md5s[0].hexdigest()
-        else:
-            digests = hashlib.md5(b''.join(m.digest() for m in md5s))
-            return f'{digests.hexdigest()}-{len(md5s)}'
+    return calculate_hashes(path, ['etag'], chunk_size)['etag']
+
+
+def read_buffer(buffer_size):
+    '''Return this thread's reusable read buffer of the given size'''
+    if buffer_size < 1:
+        # an empty buffer would read nothing, as if every file were empty
+        raise ValueError(f'The read buffer size must be positive, not {buffer_size}')
+    view = getattr(_buffers, 'view', None)
+    if view is None or len(view) != buffer_size:
+        view = memoryview(bytearray(buffer_size))
+        _buffers.view = view
+    return view
+
 
+def advise(fd, advice):
+    '''Pass a posix_fadvise access pattern hint (e.g. "SEQUENTIAL") for the
+       whole of an open file to the kernel, on platforms that support it'''
+    advice = getattr(os, f'POSIX_FADV_{advice}', None)
+    if advice is not None:
+        try:
+            os.posix_fadvise(fd, 0, 0, advice)
+        except OSError:
+            pass
 
-def calculate_hashes(path, algorithms):
+
+def calculate_hashes(path, algorithms, chunk_size=CHUNK_SIZE, buffer_size=BUFFER_SIZE,
+                     callback=None):
     '''Given a path to a file and a list of hash algorithms, calculate and
-       return a dictionary of the requested digests of the file'''
-    hashes = [(alg, getattr(hashlib, alg)()) for alg in algorithms]
-    with open(path, 'rb') as f:
+       return a dictionary of the requested digests of the file. All of the
+       digests (including "etag", using the given chunk size) are updated
+       from the same buffers, so the file is only read once. If a callback
+       is given, it is called with the length of each chunk read (e.g. to
+       report progress). When profiling is enabled, the open, read and
+       update calls are wrapped with timing hooks, so that they cost nothing
+       otherwise.'''
+    timings = instrument.TIMINGS
+    hashes = [(alg, new_hash(alg, chunk_size)) for alg in algorithms]
+    buffer = read_buffer(buffer_size)
+    if timings is not None:
+        started = time.perf_counter()
+    with open(path, 'rb', buffering=0) as f:
+        # read ahead aggressively, and afterwards drop the file from the page
+        # cache so that hashing does not evict other processes' data
+        advise(f.fileno(), 'SEQUENTIAL')
+        readinto = f.readinto
+        updates = [hash.update for (alg, hash) in hashes]
+        if timings is not None:
+            timings.add('open', time.perf_counter() - started)
+            readinto = timed_read(timings, readinto)
+            updates = [timed_update(timings, alg, hash.update) for (alg, hash) in hashes]
         while True:
-            data = f.read(8192)
-            if not data:
+            length = readinto(buffer)
+            if not length:
                 break
             else:
-                [hash.update(data) for (alg, hash) in hashes]
+                data = buffer[:length]
+                for update in updates:
+                    update(data)
+                if callback is not None:
+                    callback(length)
+        advise(f.fileno(), 'DONTNEED')
     return {alg: hash.hexdigest() for (alg, hash) in hashes}
 
 
-def chunked(handle, chunk_size):
-    # based on https://stackoverflow.com/a/54989668/5124907
-    return iter(lambda: handle.read(chunk_size), b'')
+def timed_read(timings, readinto):
+    '''Wrap a file's readinto() to record the time spent reading'''
+    clock = time.perf_counter
+
+    def read(buffer):
+        started = clock()
+        length = readinto(buffer)
+        timings.add('read', clock() - started, length)
+        return length
+    return read
+
+
+def timed_update(timings, alg, update):
+    '''Wrap a hash object's update() to record the time spent on a digest'''
+    clock = time.perf_counter
+    stage = f'digest {alg}'
+
+    def timed(data):
+        started = clock()
+        update(data)
+        timings.add(stage, clock() - started, len(data))
+    return timed
 
 
 class Asset():
     '''Class representing the metadata pertaining to an instance of
-       a particular digital asset'''
+       a particular digital asset. Assets use fixed slots rather than a
+       per-instance dictionary, so that manifests of millions of assets can
+       be held in memory; attributes not in FIELDS are kept in "extra".'''
+    __slots__ = FIELDS + ('extra',)
+
     def __init__(self, **kwargs):
-        self.relpath = None
+        for k in FIELDS:
+            setattr(self, k, None)
+        self.extra = None
         for k, v in kwargs.items():
-            setattr(self, k, v)
+            if k in FIELDS:
+                setattr(self, k, v)
+            else:
+                if self.extra is None:
+                    self.extra = {}
+                self.extra[k] = v
+        # many assets share each directory, so share the strings too
+        if isinstance(self.directory, str):
+            self.directory = sys.intern(self.directory)
+
+    def __getattr__(self, name):
+        # only called for attributes that are not slots
+        if name != 'extra' and self.extra is not None and name in self.extra:
+            return self.extra[name]
+        raise AttributeError(name)
 
     def __eq__(self, other):
         if all([(self.md5 == other.md5),
@@ -86,6 +197,13 @@ class Asset():
         else:
             return False
 
+    def as_dict(self):
+        '''Return a dictionary of the attributes that have been set'''
+        values = {k: getattr(self, k) for k in FIELDS if getattr(self, k) is not None}
+        if self.extra is not None:
+            values.update(self.extra)
+        return values
+
     @classmethod
     def from_csv(cls, sha1=None, sha256=None, **kwargs):
         '''Alternate constructor for reading data from inventory csv'''
@@ -102,15 +220,31 @@ class Asset():
                 values[mapping[k].lower()] = v
             else:
                 values[k.lower()] = v
-        if not hasattr(values, 'path'):
+        # store sizes and timestamps as integers rather than strings
+        for k in ('bytes', 'mtime'):
+            if isinstance(values.get(k), str) and values[k].isdigit():
+                values[k] = int(values[k])
+        if not values.get('path'):
             values['path'] = os.path.join(values.get('directory', ''),
                                           values.get('filename'))
         return cls(**values)
 
     @classmethod
-    def from_filesystem(cls, path, base_path, label, mount_path, *args):
-        '''Alternate constructor for reading attributes from file'''
-        if not os.path.isfile(path):
+    def from_filesystem(cls, path, base_path, label, mount_path, *args, buffer_size=BUFFER_SIZE,
+                        cache=None, stat=None, callback=None):
+        '''Alternate constructor for reading attributes from file, taking
+           the digests from the hash cache (if given) for unchanged files.
+           A stat result already obtained for the file (e.g. from a DirEntry)
+           can be supplied to avoid calling stat again, and the callback is
+           passed on to calculate_hashes.'''
+        timings = instrument.TIMINGS
+        if timings is not None:
+            started = time.perf_counter()
+        if stat is None and os.path.isfile(path):
+            stat = os.stat(path)
+            if timings is not None:
+                timings.add('stat', time.perf_counter() - started)
+        if stat is None or not S_ISREG(stat.st_mode):
             raise TypeError
         else:
             reldir = ''
@@ -122,24 +256,41 @@ class Asset():
 
             values = {
                 'path':      os.path.abspath(path),
-                'mtime':     int(os.path.getmtime(path)),
+                'mtime':     int(stat.st_mtime),
                 'directory': os.path.dirname(path),
                 'relpath':   relpath,
                 'filename':  filename,
-                'bytes':     os.path.getsize(path),
+                'bytes':     stat.st_size,
                 'extension': os.path.splitext(path)[1].lstrip('.').upper(),
                 }
 
             values['moddate'] = dt.fromtimestamp(values['mtime']).strftime('%Y-%m-%dT%H:%M:%S')
-            for algorithm, hash in calculate_hashes(path, args).items():
-                values[algorithm] = hash
-            if values['md5'] and (values['bytes'] <= CHUNK_SIZE):
-                values['etag'] = values['md5']
-            else:
-                values['etag'] = calculate_etag(path, CHUNK_SIZE)
+            # with no algorithms, only the file's metadata is read (never its
+            # contents); otherwise the etag equals the md5 for single-part
+            # files, or is calculated in the same pass as the other digests
+            if args:
+                algorithms = list(args)
+                if 'md5' not in algorithms or values['bytes'] > CHUNK_SIZE:
+                    algorithms.append('etag')
+                hashes = None
+                if cache is not None and not cache.verify:
+                    if timings is not None:
+                        looked_up = time.perf_counter()
+                    hashes = cache.lookup(stat, algorithms)
+                    if timings is not None:
+                        timings.add('cache lookup', time.perf_counter() - looked_up)
+                if hashes is None:
+                    hashes = calculate_hashes(path, algorithms, buffer_size=buffer_size,
+                                              callback=callback)
+                    if cache is not None:
+                        cache.store(path, stat, hashes)
+                values.update(hashes)
+                values.setdefault('etag', values.get('md5'))
 
             if label is not None:
                 values['storagelocation'] = f'{label}:{os.path.relpath(path, mount_path)}'
                 values['storageprovider'] = 'HDD'
 
+        if timings is not None:
+            timings.add_file(path, time.perf_counter() - started, values['bytes'])
         return cls(**values)
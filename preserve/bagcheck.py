@@ -1,37 +1,313 @@
+import hashlib
 import os
+import posixpath
+import re
 import tarfile
 
+from .asset import calculate_hashes, new_hash, read_buffer
 from .manifest import Manifest
+from .utils import iter_files, ordered_map
+
+# the tag files that can be found in the root directory of a bag
+TAG_FILE = re.compile(r'(bagit|bag-info|(tag)?manifest-\w+)\.txt')
+PAYLOAD_MANIFEST = re.compile(r'manifest-(\w+)\.txt')
+
+# the payload is always hashed with these, as well as with the algorithms
+# of any other manifests in the bag
+FIXITY_ALGORITHMS = ['md5', 'sha256']
+
+# the payload of a tar bag is hashed with these when it comes before the
+# manifests of the bag, so that any of the usual manifests can be checked
+STREAM_ALGORITHMS = ['md5', 'sha1', 'sha256', 'sha512']
+
+
+def parse_manifest(lines):
+    '''Parse the lines (text or bytes) of a BagIt manifest into a set of
+       (checksum, path) tuples'''
+    result = set()
+    for line in lines:
+        if isinstance(line, bytes):
+            line = line.decode('utf-8')
+        line = line.strip()
+        if line:
+            result.add(tuple(line.split(maxsplit=1)))
+    return result
+
+
+def tags_complete(tags, wanted=None):
+    '''Given the tag files read so far, return whether all the ones needed
+       have been read: either all of the wanted files, or (if none are given)
+       all of the manifests listed in a tag manifest'''
+    if wanted is not None:
+        return all(name in tags for name in wanted)
+    for name, contents in tags.items():
+        if name.startswith('tagmanifest-'):
+            listed = {path for checksum, path in parse_manifest(contents.splitlines())}
+            return all(path in tags for path in listed if TAG_FILE.fullmatch(path))
+    return False
+
+
+def is_tag_candidate(directory, filename):
+    '''Whether an archive member may be a tag file: tag files are at the top
+       of the archive or one directory down, but never in the payload
+       directory of a bag at the top of the archive'''
+    return '/' not in directory and directory != 'data' and TAG_FILE.fullmatch(filename)
+
+
+def read_tar_tags(path, wanted=None):
+    '''Read the tag files of a bag in a tar archive (compressed or not) in a
+       single sequential pass, without seeking or scanning the archive first.
+       The root of the bag is the directory in the archive that contains
+       bagit.txt. Reading stops as soon as the tag files needed have been
+       read (see tags_complete), so that the rest of the archive is never
+       decompressed. Returns the root (ending with a slash, or '' if the bag
+       is at the top of the archive) and a dictionary of the contents of the
+       tag files by name.'''
+    candidates = {}
+    root = None
+    with tarfile.open(path, mode='r|*') as tar:
+        for member in tar:
+            if not member.isfile():
+                continue
+            name = member.name[2:] if member.name.startswith('./') else member.name
+            directory, filename = posixpath.split(name)
+            if not is_tag_candidate(directory, filename):
+                continue
+            candidates[name] = tar.extractfile(member).read()
+            if filename == 'bagit.txt' and root is None:
+                root = posixpath.join(directory, '')
+            if root is not None and tags_complete(tags_in(candidates, root), wanted):
+                return root, tags_in(candidates, root)
+    if root is None:
+        raise RuntimeError(f'{path} does not contain a bag (no bagit.txt was found)')
+    return root, tags_in(candidates, root)
+
+
+def tags_in(candidates, root):
+    '''Select the tag files in the root directory of the bag, by name'''
+    return {name[len(root):]: contents for name, contents in candidates.items()
+            if posixpath.join(posixpath.dirname(name), '') == root}
 
 
 def inspect(bag: str) -> set:
     """
     Checks the given bag. If the bag is a directory, it
     will open the bag and then open the manifest file.
-    If the bag is as a tar or tar.gz file, it will open
-    the manifest file in the archive.
+    If the bag is as a tar or tar.gz file, it will read the
+    manifest file from the archive in a single streaming pass.
     Otherwise, raises a RuntimeError.
     """
     if os.path.isdir(bag):
         with open(os.path.join(bag, 'manifest-md5.txt')) as bag_manifest:
-            return {tuple(line.strip().split(maxsplit=1)) for line in bag_manifest}
+            return parse_manifest(bag_manifest)
 
-    elif tarfile.is_tarfile(bag):
-        directory_name = bag.split('/')[-1].split('.')[0]
-        tar = tarfile.open(bag, mode='r:*')
-
-        with tar.extractfile(f'{directory_name}/manifest-md5.txt') as bag_manifest:
-            return {tuple(line.strip().split(maxsplit=1)) for line in bag_manifest}
+    elif os.path.isfile(bag):
+        try:
+            root, tags = read_tar_tags(bag, wanted=['manifest-md5.txt'])
+        except tarfile.ReadError:
+            raise RuntimeError(f'{bag} is neither a directory or a tar file')
+        if 'manifest-md5.txt' not in tags:
+            raise RuntimeError(f'{bag} has no manifest-md5.txt in {root or "the top level"}')
+        return parse_manifest(tags['manifest-md5.txt'].splitlines())
 
     else:
         raise RuntimeError(f'{bag} is neither a directory or a tar file')
 
 
+def hash_stream(handle, algorithms):
+    '''Calculate the digests of an open file (e.g. an archive member) with
+       all of the algorithms at once, returning the digests and the size'''
+    hashes = [(alg, new_hash(alg)) for alg in algorithms]
+    buffer = read_buffer(1024 ** 2)
+    size = 0
+    while True:
+        length = handle.readinto(buffer)
+        if not length:
+            break
+        data = buffer[:length]
+        for alg, hash in hashes:
+            hash.update(data)
+        size += length
+    return {alg: hash.hexdigest() for alg, hash in hashes}, size
+
+
+def read_dir_tags(bag):
+    '''Read the tag files in the root directory of a bag, by name'''
+    tags = {}
+    for name in os.listdir(bag):
+        path = os.path.join(bag, name)
+        if TAG_FILE.fullmatch(name) and os.path.isfile(path):
+            with open(path, 'rb') as handle:
+                tags[name] = handle.read()
+    return tags
+
+
+def hashing_algorithms(tags=None):
+    '''Return the algorithms to hash the payload with: md5 and sha256, plus
+       any others used by the payload manifests that hashlib supports'''
+    algorithms = list(FIXITY_ALGORITHMS)
+    for name in tags or ():
+        m = PAYLOAD_MANIFEST.fullmatch(name)
+        if m and m.group(1) not in algorithms and m.group(1) in hashlib.algorithms_guaranteed:
+            algorithms.append(m.group(1))
+    return algorithms
+
+
+def dir_payload(bag, workers=1):
+    '''Hash every payload file of a bag directory on a pool of worker
+       threads, returning the tag files and a dictionary of (digests, size)
+       by the path of each payload file relative to the bag'''
+    if not os.path.isdir(os.path.join(bag, 'data')):
+        raise RuntimeError(f'{bag} has no payload directory (data/)')
+    tags = read_dir_tags(bag)
+    algorithms = hashing_algorithms(tags)
+
+    def check(entry):
+        return entry.path, calculate_hashes(entry.path, algorithms), entry.stat().st_size
+
+    payload = {}
+    files = iter_files(os.path.join(bag, 'data'), prune_hidden_files=False, prune_hidden_dirs=False)
+    for path, digests, size in ordered_map(check, files, workers):
+        relpath = os.path.relpath(path, bag).replace(os.sep, '/')
+        payload[relpath] = (digests, size)
+    return tags, payload
+
+
+def tar_payload(path):
+    '''Hash every payload file of a bag in a tar archive (compressed or not)
+       in a single sequential pass, returning the tag files and a dictionary
+       of (digests, size) by the path of each payload file relative to the
+       bag. The payload is hashed with the algorithms of the manifests read
+       so far, or (as the tag files may come after the payload) with md5,
+       sha1, sha256 and sha512 before any manifests are known.'''
+    algorithms = STREAM_ALGORITHMS
+    candidates = {}
+    files = {}
+    directories = set()
+    root = None
+    with tarfile.open(path, mode='r|*') as tar:
+        for member in tar:
+            name = member.name[2:] if member.name.startswith('./') else member.name
+            if member.isdir():
+                directories.add(name.rstrip('/'))
+            if not member.isfile():
+                continue
+            directory, filename = posixpath.split(name)
+            if is_tag_candidate(directory, filename):
+                candidates[name] = tar.extractfile(member).read()
+                if filename == 'bagit.txt' and root is None:
+                    root = posixpath.join(directory, '')
+                if PAYLOAD_MANIFEST.fullmatch(filename):
+                    algorithms = hashing_algorithms(
+                        [posixpath.basename(n) for n in candidates if posixpath.dirname(n) == directory]
+                        )
+            else:
+                files[name] = hash_stream(tar.extractfile(member), algorithms)
+    if root is None:
+        raise RuntimeError(f'{path} does not contain a bag (no bagit.txt was found)')
+    payload = {name[len(root):]: result for name, result in files.items()
+               if name.startswith(root + 'data/')}
+    if not payload and root + 'data' not in directories:
+        raise RuntimeError(f'{path} has no payload directory ({root}data/)')
+    return tags_in(candidates, root), payload
+
+
+def print_problems(description, problems):
+    if problems:
+        print(f" => {len(problems)} {description}:")
+        for n, problem in enumerate(sorted(problems), 1):
+            print(f"    {n}. {problem}")
+    return len(problems)
+
+
+def check_fixity(tags, payload, inventory=None):
+    '''Check the digests of the payload against every payload manifest in
+       the bag and (if given) against the inventory, printing any problems
+       found. Returns the number of problems.'''
+    problems = 0
+    manifests = {}
+    for name, contents in sorted(tags.items()):
+        m = PAYLOAD_MANIFEST.fullmatch(name)
+        if m:
+            manifests[m.group(1)] = {path: checksum.lower() for checksum, path
+                                     in parse_manifest(contents.splitlines())}
+    if not manifests:
+        print(" => No payload manifests found in bag!")
+        problems += 1
+
+    for alg, expected in manifests.items():
+        print(f"Checking payload against manifest-{alg}.txt ({len(expected)} files)...")
+        missing = [path for path in expected if path not in payload]
+        unlisted = [path for path in payload if path not in expected]
+        unchecked = []
+        mismatched = []
+        for path, checksum in expected.items():
+            if path in payload:
+                digests = payload[path][0]
+                if alg not in digests:
+                    unchecked.append(path)
+                elif digests[alg] != checksum:
+                    mismatched.append(f"{path} ({alg} {digests[alg]} != {checksum})")
+        problems += print_problems("files listed but not in payload", missing)
+        problems += print_problems("payload files not listed", unlisted)
+        problems += print_problems("files with checksums that do not match", mismatched)
+        problems += print_problems(f"files that could not be checked with {alg}", unchecked)
+
+    if inventory is not None:
+        print(f"Checking payload against inventory ({len(inventory)} assets)...")
+        missing = []
+        mismatched = []
+        for asset in inventory:
+            path = posixpath.join('data', asset.relpath.replace(os.sep, '/'))
+            if path not in payload:
+                missing.append(path)
+                continue
+            digests, size = payload[path]
+            if isinstance(asset.bytes, int) and asset.bytes != size:
+                mismatched.append(f"{path} (bytes {size} != {asset.bytes})")
+            for alg in FIXITY_ALGORITHMS:
+                value = getattr(asset, alg)
+                if value and value.lower() != digests[alg]:
+                    mismatched.append(f"{path} ({alg} {digests[alg]} != {value})")
+        problems += print_problems("inventory files not in payload", missing)
+        problems += print_problems("inventory files that do not match the payload", mismatched)
+
+    if problems:
+        print(f" => Fixity check failed, with {problems} problems.")
+    else:
+        print(f" => Fixity check passed for all {len(payload)} payload files!")
+    return problems
+
+
+def fixity(args):
+    '''Verify the payload of the bag: every file is read and hashed, and
+       checked against the manifests of the bag and the inventory'''
+    inventory = None
+    if args.inventory:
+        inventory = Manifest(args.inventory)
+        print(f"Read asset inventory at {args.inventory}: {len(inventory)} assets.")
+
+    print(f"Reading the payload of the bag at {args.bag}...")
+    try:
+        if os.path.isdir(args.bag):
+            tags, payload = dir_payload(args.bag, getattr(args, 'workers', None) or 1)
+        else:
+            tags, payload = tar_payload(args.bag)
+    except (tarfile.ReadError, RuntimeError) as e:
+        return f"ERROR: Could not read bag {args.bag}: {e}\n"
+    print(f" => {len(payload)} payload files read.")
+
+    check_fixity(tags, payload, inventory)
+
+
 def bagcheck(args):
     """
     Check inventory contents against relpaths & checksums of a bag manifest.
     """
 
+    if getattr(args, 'fixity', False):
+        return fixity(args)
+
     # create sets representing the two asset manifests
     print(f"Reading asset inventory at {args.inventory}...")
     inventory = Manifest(args.inventory)
@@ -42,7 +318,7 @@ def bagcheck(args):
     print(f" => {len(bag)} items in bag manifest.")
 
     print(f"Confirming all inventory files are present in bag...")
-    assets_to_check = {(a.sha256, os.path.join('data', a.relpath)) for a in inventory}
+    assets_to_check = {(a.md5, os.path.join('data', a.relpath)) for a in inventory}
 
     # find differences between the two sets
     missing = sorted(assets_to_check - bag)
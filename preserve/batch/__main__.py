@@ -3,12 +3,17 @@
 import csv
 import os
 import sys
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 
 import yaml
 
-from ..__main__ import print_header as print_header
 from ..inventory import inventory as inventory
+from ..utils import FileEntry as FileEntry
+from ..utils import header as header
 from ..utils import human_readable as human_readable
+from ..utils import iter_files as iter_files
+from ..utils import read_listing as read_listing
+from ..utils import write_listing as write_listing
 
 
 def table_format(results):
@@ -50,7 +55,7 @@ class Directory():
     '''Class representing a directory to be scanned in a batch process'''
 
     def __init__(self, path, dirname=None, filecount=None, bytecount=None,
-                 humanread=None, status=None):
+                 humanread=None, status=None, listing=None):
         self.path = path
         self.status = status or 'ToDo'
         self.dirname = dirname or os.path.basename(path)
@@ -58,7 +63,7 @@ class Directory():
             self.filecount = filecount
             self.bytecount = bytecount
         else:
-            self.filecount, self.bytecount = self.summarize()
+            self.filecount, self.bytecount = self.summarize(listing)
         if humanread:
             self.humanread = humanread
         else:
@@ -66,19 +71,140 @@ class Directory():
                 [str(i) for i in human_readable(self.bytecount)]
                 )
 
-    def summarize(self):
+    def summarize(self, listing=None):
+        '''Count the files and bytes in the directory, saving the list of
+           files and their stat results to the listing file (if given) so
+           that the inventory does not need to walk the directory again'''
         filecount = 0
         bytecount = 0
-        for (dir, subdirs, files) in os.walk(self.path):
-            files = [f for f in files if not f.startswith('.')]
-            subdirs[:] = [d for d in subdirs if not d.startswith('.')]
-            filecount += len(files)
-            for file in files:
-                path = os.path.join(dir, file)
-                bytecount += os.path.getsize(path)
+        directories = []
+        entries = iter_files(self.path, directories=directories)
+        if listing is not None:
+            entries = write_listing(listing, entries, directories)
+        for entry in entries:
+            filecount += 1
+            bytecount += entry.stat().st_size
         return filecount, bytecount
 
 
+def listing_path(outdir, dirname):
+
+    '''Return the path of the saved listing of files in a directory'''
+
+    return os.path.join(outdir, dirname + '.listing.csv')
+
+
+def listing_is_current(listing):
+
+    '''Check that no files have been added, removed or renamed since the
+       listing was saved, i.e. that none of the directories walked (including
+       empty ones) has been modified since. A listing without directories
+       (e.g. from an older version) is never current.'''
+
+    directories = list(read_listing(listing, directories=True))
+    if not directories:
+        return False
+    for entry in directories:
+        try:
+            stat = os.stat(entry.path)
+        except OSError:
+            return False
+        saved = entry.stat()
+        if (stat.st_dev, stat.st_ino, stat.st_mtime_ns) != \
+                (saved.st_dev, saved.st_ino, saved.st_mtime_ns):
+            return False
+    return True
+
+
+def current_entries(listing, missing):
+
+    '''Generate the files in the listing with their current stat results,
+       so that any file changed since the listing was saved is inventoried
+       as it is now; files that no longer exist are added to missing'''
+
+    for entry in read_listing(listing):
+        try:
+            yield FileEntry(entry.path, os.stat(entry.path))
+        except FileNotFoundError:
+            missing.append(entry.path)
+
+
+def write_manifest(path, batchdirs):
+
+    '''Write out the manifest file summarizing the batch, replacing any
+       previous version atomically'''
+
+    fieldnames = ['path', 'dirname', 'filecount', 'bytecount',
+                  'humanread', 'status']
+    with open(path + '.tmp', 'w') as handle:
+        writer = csv.DictWriter(handle, fieldnames=fieldnames)
+        writer.writeheader()
+        for dir in batchdirs:
+            writer.writerow({'path': dir.path,
+                             'dirname': dir.dirname,
+                             'filecount': dir.filecount,
+                             'bytecount': dir.bytecount,
+                             'humanread': dir.humanread,
+                             'status': dir.status
+                             })
+        handle.flush()
+        os.fsync(handle.fileno())
+    os.replace(path + '.tmp', path)
+
+
+def schedule(batchdirs, run, workers=1, device_limit=1, device_limits=None):
+
+    '''Call run(dir) for each directory on a pool of threads, running at
+       most "workers" directories at once, and at most "device_limit" (or
+       the limit given for the device in "device_limits", keyed by st_dev)
+       on each physical device. Yields each directory with the result of
+       its run as it completes.'''
+
+    device_limits = device_limits or {}
+    pending = [(os.stat(dir.path).st_dev, dir) for dir in batchdirs]
+    running = {}
+    active = {}
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        while pending or active:
+            # start every pending directory whose device has capacity
+            for device, dir in list(pending):
+                if len(active) >= workers:
+                    break
+                if running.get(device, 0) < device_limits.get(device, device_limit):
+                    pending.remove((device, dir))
+                    running[device] = running.get(device, 0) + 1
+                    active[executor.submit(run, dir)] = (device, dir)
+            done, _ = wait(active, return_when=FIRST_COMPLETED)
+            for future in done:
+                device, dir = active.pop(future)
+                running[device] -= 1
+                try:
+                    yield dir, future.result()
+                except Exception as err:
+                    yield dir, f'ERROR: {err}\n'
+
+
+def read_limits(config):
+
+    '''Return the limits on the number of directories inventoried at once,
+       in total and per physical device, from the batch configuration;
+       device limits are keyed by the path of any directory on the device.
+       Exits if any limit is not a positive number, as no directory could
+       ever be started.'''
+
+    workers = config.get('WORKERS', 1)
+    device_limit = config.get('DEVICE_LIMIT', 1)
+    device_limits = config.get('DEVICE_LIMITS') or {}
+    for name, limit in [('WORKERS', workers), ('DEVICE_LIMIT', device_limit),
+                        *((f'DEVICE_LIMITS[{path}]', limit)
+                          for path, limit in device_limits.items())]:
+        if not isinstance(limit, int) or limit < 1:
+            sys.exit(f'{name} must be a positive number, not {limit!r}; exiting.')
+    return workers, device_limit, {
+        os.stat(path).st_dev: limit for path, limit in device_limits.items()
+        }
+
+
 class CommandArgs():
 
     '''A simple class to create a stand-in for the argparse namespace object'''
@@ -97,7 +223,10 @@ def main():
     EXCLUDES = config['EXCLUDES']
     MANIFEST = config['MANIFEST']
 
-    print_header('batch inventory')
+    # optional limits on the number of directories inventoried at once
+    WORKERS, DEVICE_LIMIT, DEVICE_LIMITS = read_limits(config)
+
+    sys.stderr.write(header('batch inventory'))
     print()
 
     # check input path; exit if not exists
@@ -122,7 +251,7 @@ def main():
         for entry in os.listdir(INDIR):
             path = os.path.join(INDIR, entry)
             if os.path.isdir(path):
-                dir = Directory(path)
+                dir = Directory(path, listing=listing_path(OUTDIR, entry))
                 if dir.dirname in EXCLUDES:
                     dir.status = 'Exclude'
                 batchdirs.append(dir)
@@ -134,28 +263,19 @@ def main():
     sys.stderr.write(table_format(batchdirs))
 
     # Write out the manifest file, summarizing the batch
-    with open(MANIFEST, 'w') as handle:
-        fieldnames = ['path', 'dirname', 'filecount', 'bytecount',
-                      'humanread', 'status']
-        writer = csv.DictWriter(handle, fieldnames=fieldnames)
-        writer.writeheader()
-        for dir in batchdirs:
-            writer.writerow({'path': dir.path,
-                             'dirname': dir.dirname,
-                             'filecount': dir.filecount,
-                             'bytecount': dir.bytecount,
-                             'humanread': dir.humanread,
-                             'status': dir.status
-                             })
+    write_manifest(MANIFEST, batchdirs)
 
-    # Process each directory in the batch
-    for dir in batchdirs:
-        if dir.status == 'Exclude':
-            continue
+    def run(dir):
         args = CommandArgs({'path': os.path.join(INDIR, dir.dirname),
+                            'batch': dir.dirname,
                             'outfile': None,
                             'existing': None,
-                            'algorithms': 'md5'
+                            'algorithms': 'md5',
+                            'label': None,
+                            'mount': None,
+                            # the directories may be inventoried at once, so
+                            # their progress is told apart by name
+                            'progress_label': f'{dir.dirname}: Files checked'
                             })
         outpath = os.path.join(OUTDIR, dir.dirname + '.csv')
         if os.path.isfile(outpath):
@@ -163,13 +283,38 @@ def main():
         else:
             args.outfile = outpath
 
+        # Reuse the files found when the batch was summarized, unless the
+        # directory has changed since (e.g. when a batch is resumed)
+        listing = listing_path(OUTDIR, dir.dirname)
+        missing = []
+        if os.path.isfile(listing):
+            if not listing_is_current(listing):
+                sys.stderr.write(f'{dir.dirname}: files have changed, listing them again\n')
+                dir.filecount, dir.bytecount = dir.summarize(listing)
+                dir.humanread = ' '.join(str(i) for i in human_readable(dir.bytecount))
+            args.files = current_entries(listing, missing)
+            args.total = int(dir.filecount)
+            args.total_bytes = int(dir.bytecount)
+
         # Call the inventory subcommand generated args
         result = inventory(args)
+        if missing:
+            sys.stderr.write(f'{dir.dirname}: {len(missing)} listed files no longer exist:\n')
+            for n, path in enumerate(missing, 1):
+                sys.stderr.write(f'  ({n}) {path}\n')
+        return result
 
-        if result:
-            sys.stderr.write(result + '\n')
+    # Process the directories in the batch concurrently, recording the
+    # status of each in the manifest as soon as it completes
+    todo = [dir for dir in batchdirs if dir.status not in ('Exclude', 'Complete')]
+    for dir, result in schedule(todo, run, WORKERS, DEVICE_LIMIT, DEVICE_LIMITS):
+        if result is None or result == "Inventory is already complete.\n":
             dir.status = 'Complete'
-            sys.stderr.write(table_format(batchdirs))
+        else:
+            sys.stderr.write(f'{dir.dirname}: {result}\n')
+            dir.status = 'Error'
+        write_manifest(MANIFEST, batchdirs)
+        sys.stderr.write(table_format(batchdirs))
 
 
 if __name__ == "__main__":
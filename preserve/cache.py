@@ -0,0 +1,162 @@
+import os
+import sqlite3
+import sys
+import threading
+import time
+
+CACHE_DIR = os.path.join(
+    os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache'), 'preserve'
+    )
+CACHE_PATH = os.path.join(CACHE_DIR, 'hashes.sqlite')
+DIGESTS = ['md5', 'sha1', 'sha256', 'etag']
+SEARCHABLE = ['md5', 'sha256']
+
+# entries not used for this long are evicted, as are the least recently
+# used entries beyond the maximum number of entries
+MAX_AGE = 180 * 24 * 60 * 60
+MAX_ENTRIES = 20_000_000
+
+# number of writes to accumulate before committing a transaction
+COMMIT_INTERVAL = 1000
+
+
+class HashCache():
+    '''Persistent cache of file digests, stored in a SQLite database and
+       keyed on (device, inode, size, mtime_ns) so that unchanged files can
+       be inventoried without reading them. In verify mode the cache is
+       never used to skip hashing; instead the digests calculated are checked
+       against the cached values and any differences are recorded as
+       mismatches.'''
+
+    def __init__(self, path=CACHE_PATH, verify=False):
+        self.path = path
+        self.verify = verify
+        self.mismatches = []
+        self.pending = 0
+        self.lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS hashes ('
+            ' device INTEGER, inode INTEGER, size INTEGER, mtime_ns INTEGER,'
+            ' path TEXT, md5 TEXT, sha1 TEXT, sha256 TEXT, etag TEXT,'
+            ' accessed REAL, PRIMARY KEY (device, inode))'
+            )
+        self.connection.execute(
+            'CREATE INDEX IF NOT EXISTS hashes_accessed ON hashes (accessed)'
+            )
+        # files can also be looked up by their contents (see find)
+        for alg in SEARCHABLE:
+            self.connection.execute(
+                f'CREATE INDEX IF NOT EXISTS hashes_{alg} ON hashes ({alg})'
+                )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _select(self, stat):
+        '''Return the cached digests for an unchanged file, or None'''
+        row = self.connection.execute(
+            'SELECT md5, sha1, sha256, etag FROM hashes'
+            ' WHERE device = ? AND inode = ? AND size = ? AND mtime_ns = ?',
+            (stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime_ns)
+            ).fetchone()
+        if row is not None:
+            return {k: v for k, v in zip(DIGESTS, row) if v is not None}
+
+    def _commit(self):
+        self.pending += 1
+        if self.pending >= COMMIT_INTERVAL:
+            self.connection.commit()
+            self.pending = 0
+
+    def lookup(self, stat, algorithms, path=None):
+        '''Return a dictionary of the requested digests for the file with
+           the given stat result, or None unless all of them are cached. If
+           the path of the file is given, it replaces the cached path, which
+           is out of date if the file has been renamed (see find).'''
+        with self.lock:
+            cached = self._select(stat)
+            if cached is None or any(alg not in cached for alg in algorithms):
+                return None
+            if path is None:
+                self.connection.execute(
+                    'UPDATE hashes SET accessed = ? WHERE device = ? AND inode = ?',
+                    (time.time(), stat.st_dev, stat.st_ino)
+                    )
+            else:
+                self.connection.execute(
+                    'UPDATE hashes SET accessed = ?, path = ? WHERE device = ? AND inode = ?',
+                    (time.time(), os.path.abspath(path), stat.st_dev, stat.st_ino)
+                    )
+            self._commit()
+        return {alg: cached[alg] for alg in algorithms}
+
+    def store(self, path, stat, digests):
+        '''Record newly calculated digests for the file with the given stat
+           result, merging them with any digests already cached for it.'''
+        with self.lock:
+            cached = self._select(stat) or {}
+            mismatched = [alg for alg, value in digests.items()
+                          if alg in cached and cached[alg] != value]
+            if mismatched:
+                # the file is unchanged according to its metadata, but its
+                # contents are not: keep the cached values as the reference
+                self.mismatches.append((path, mismatched))
+                sys.stderr.write(
+                    f"\nWARNING: {', '.join(mismatched)} of {path} differs from the cached value\n"
+                    )
+                return
+            cached.update(digests)
+            self.connection.execute(
+                'INSERT OR REPLACE INTO hashes VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime_ns, os.path.abspath(path),
+                 *(cached.get(alg) for alg in DIGESTS), time.time())
+                )
+            self._commit()
+
+    def find(self, algorithm, digest):
+        '''Return a list of (path, device, inode, size, mtime_ns) tuples for
+           the files recorded with the given md5 or sha256 digest. The files
+           may have changed or gone since, so the caller should check them.'''
+        if algorithm not in SEARCHABLE:
+            raise ValueError(f'Cannot search the cache by {algorithm}')
+        with self.lock:
+            return self.connection.execute(
+                f'SELECT path, device, inode, size, mtime_ns FROM hashes WHERE {algorithm} = ?',
+                (digest,)
+                ).fetchall()
+
+    def evict(self, max_age=MAX_AGE, max_entries=MAX_ENTRIES):
+        '''Remove entries that have not been used within max_age seconds,
+           and then the least recently used entries beyond max_entries.'''
+        with self.lock:
+            self.connection.execute(
+                'DELETE FROM hashes WHERE accessed < ?', (time.time() - max_age,)
+                )
+            self.connection.execute(
+                'DELETE FROM hashes WHERE rowid IN (SELECT rowid FROM hashes'
+                ' ORDER BY accessed DESC LIMIT -1 OFFSET ?)', (max_entries,)
+                )
+            self.connection.commit()
+            self.pending = 0
+
+    def close(self):
+        self.evict()
+        self.connection.close()
+
+
+def open_cache(args):
+    '''Open the hash cache requested by the command-line arguments, returning
+       None if caching is disabled or the cache cannot be opened.'''
+    path = getattr(args, 'cache', None)
+    if path is None:
+        return None
+    try:
+        return HashCache(path, verify=getattr(args, 'verify_cache', False))
+    except (OSError, sqlite3.Error) as err:
+        sys.stderr.write(f"WARNING: Could not open hash cache {path}: {err}\n")
+        return None
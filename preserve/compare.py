@@ -1,6 +1,9 @@
+import heapq
 import os
 import sys
+import tempfile
 
+from .extsort import ExternalSorter, distinct, memory_limit
 from .manifest import Manifest
 
 # === SUBCOMMAND =============================================================
@@ -10,38 +13,98 @@ from .manifest import Manifest
 # ============================================================================
 
 
+def index_manifests(paths, key):
+    '''Read each manifest once, building a single index that maps the key of
+       every asset to a bitmask of the manifests in which it appears, and
+       generate the (key, bitmask) pairs in key order.'''
+    index = {}
+    for n, manifest_file in enumerate(paths):
+        bit = 1 << n
+        for a in Manifest(manifest_file):
+            k = key(a)
+            index[k] = index.get(k, 0) | bit
+    yield from sorted(index.items())
+
+
+def merge_manifests(paths, key, memory_limit, tmpdir=None):
+    '''Sort the keys of each manifest externally, and merge them to generate
+       the same (key, bitmask) pairs as index_manifests, in key order.'''
+    sorters = []
+    for manifest_file in paths:
+        sorter = ExternalSorter(memory_limit // len(paths), tmpdir)
+        for a in Manifest(manifest_file):
+            sorter.add(key(a))
+        sorters.append(sorter)
+
+    def tagged(sorter, bit):
+        for k in distinct(sorter):
+            yield k, bit
+    streams = [tagged(sorter, 1 << n) for n, sorter in enumerate(sorters)]
+    current, mask = None, 0
+    for k, bit in heapq.merge(*streams):
+        if mask and k != current:
+            yield current, mask
+            mask = 0
+        current = k
+        mask |= bit
+    if mask:
+        yield current, mask
+    for sorter in sorters:
+        sorter.close()
+
+
 def compare(args):
     '''Compare asset manifests checking for the presence of assets only'''
-    asset_sets = {}
     all_paths = [args.first] + args.other
     for manifest_file in all_paths:
         if not os.path.exists(manifest_file):
             sys.exit("{0} does not exist".format(manifest_file))
+
+    if args.relpath:
+        def key(a):
+            return (a.relpath, str(a.bytes))
+    else:
+        def key(a):
+            return (a.filename, str(a.bytes))
+
+    limit = memory_limit(args)
+    if limit is None:
+        report(all_paths, index_manifests(all_paths, key), [[] for path in all_paths])
+    else:
+        # half of the memory is for sorting the manifests, and half for the
+        # keys unique to each of them; all the run files are removed with
+        # the temporary directory
+        with tempfile.TemporaryDirectory(prefix='preserve-', dir=getattr(args, 'tmpdir', None)) as tmpdir:
+            pairs = merge_manifests(all_paths, key, limit // 2, tmpdir)
+            differences = [ExternalSorter(limit // (2 * len(all_paths)), tmpdir) for path in all_paths]
+            report(all_paths, pairs, differences)
+
+
+def report(all_paths, pairs, differences):
+    '''Print the number of keys common to all the manifests, and the keys
+       unique to each, given the (key, bitmask) pairs in key order; the keys
+       unique to each manifest are appended to its list (or sorter) in
+       differences, and so are listed in order.'''
+
+    # Sort the keys into those common to all the inventories and those
+    # missing from at least one
+    everywhere = (1 << len(all_paths)) - 1
+    common = 0
+    for k, mask in pairs:
+        if mask == everywhere:
+            common += 1
         else:
-            m = Manifest(manifest_file)
-            if args.relpath:
-                s = set()
-                for a in m:
-                    relpath = os.path.relpath(('/' + a.path), m.root)
-                    bytes = str(a.bytes)
-                    for a in m:
-                        s.add((relpath, bytes))
-            else:
-                s = set([(a.filename, str(a.bytes)) for a in m])
-            asset_sets[manifest_file] = s
+            for n, unique in enumerate(differences):
+                if mask & (1 << n):
+                    unique.append(k)
 
     # Report degree to which the inventories all match
-    common = set.intersection(*asset_sets.values())
-    print("{} values are common to all the supplied files:".format(
-                                                                len(common)))
+    print("{} values are common to all the supplied files:".format(common))
 
     # Report the differences (if any) in the individual files
-    for n, (path, asset_set) in enumerate(asset_sets.items()):
-        unique = asset_set.difference(common)
+    for n, (path, unique) in enumerate(zip(all_paths, differences)):
         print(" => Path {0}: {1} values are unique to {2}".format(
                 n+1, len(unique), path))
-        if unique is not None:
-            sorted_files = sorted(unique)
-            for n, (relpath, bytes) in enumerate(sorted_files):
-                print("     ({0}) {1} -- {2} bytes".format(n+1, relpath, bytes))
+        for m, (relpath, bytes) in enumerate(unique):
+            print("     ({0}) {1} -- {2} bytes".format(m+1, relpath, bytes))
     print('')
@@ -0,0 +1,130 @@
+import heapq
+import os
+import pickle
+import tempfile
+
+MB = 1024 ** 2
+
+# estimated memory used by each item held for sorting, beyond the
+# contents of its strings
+ITEM_OVERHEAD = 200
+
+# number of items pickled together in a run file
+BATCH_SIZE = 1000
+
+# runs are merged into a single run once there are this many of them, to
+# limit the number of files open at once
+MAX_RUNS = 64
+
+
+def item_size(item):
+    '''Estimate the memory used by an item: a string, bytes or a tuple of them'''
+    if isinstance(item, tuple):
+        return ITEM_OVERHEAD + sum(len(x) for x in item if isinstance(x, (str, bytes)))
+    elif isinstance(item, (str, bytes)):
+        return ITEM_OVERHEAD + len(item)
+    return ITEM_OVERHEAD
+
+
+def write_run(path, items):
+    with open(path, 'wb') as handle:
+        for start in range(0, len(items), BATCH_SIZE):
+            pickle.dump(items[start:start + BATCH_SIZE], handle, pickle.HIGHEST_PROTOCOL)
+
+
+def read_run(path):
+    with open(path, 'rb') as handle:
+        while True:
+            try:
+                batch = pickle.load(handle)
+            except EOFError:
+                return
+            yield from batch
+
+
+def distinct(items):
+    '''Generate the items of a sorted iterable, without repeats'''
+    previous = sentinel = object()
+    for item in items:
+        if previous is sentinel or item != previous:
+            yield item
+        previous = item
+
+
+class ExternalSorter():
+    '''Sorts any number of items in a bounded amount of memory. Items are
+       collected in memory until the memory limit is reached, and then sorted
+       and spilled to a run file in the temporary directory; iterating over
+       the sorter merges the runs. If the limit is never reached, the items
+       are simply sorted in memory. The sorter can be iterated more than once,
+       until it is closed.'''
+
+    def __init__(self, memory_limit, tmpdir=None):
+        self.memory_limit = memory_limit
+        self.tmpdir = tmpdir
+        self.items = []
+        self.size = 0
+        self.count = 0
+        self.runs = []
+
+    def __len__(self):
+        return self.count
+
+    def add(self, item):
+        self.items.append(item)
+        self.size += item_size(item)
+        self.count += 1
+        if self.size >= self.memory_limit:
+            self.spill()
+
+    append = add
+
+    def spill(self):
+        '''Sort the items in memory and write them out as a new run'''
+        if not self.items:
+            return
+        self.items.sort()
+        fd, path = tempfile.mkstemp(prefix='run-', suffix='.pickle', dir=self.tmpdir)
+        os.close(fd)
+        write_run(path, self.items)
+        self.runs.append(path)
+        self.items = []
+        self.size = 0
+        if len(self.runs) >= MAX_RUNS:
+            self.merge_runs()
+
+    def merge_runs(self):
+        '''Replace all of the runs with a single run'''
+        fd, path = tempfile.mkstemp(prefix='run-', suffix='.pickle', dir=self.tmpdir)
+        with os.fdopen(fd, 'wb') as handle:
+            batch = []
+            for item in heapq.merge(*[read_run(run) for run in self.runs]):
+                batch.append(item)
+                if len(batch) == BATCH_SIZE:
+                    pickle.dump(batch, handle, pickle.HIGHEST_PROTOCOL)
+                    batch = []
+            if batch:
+                pickle.dump(batch, handle, pickle.HIGHEST_PROTOCOL)
+        for run in self.runs:
+            os.remove(run)
+        self.runs = [path]
+
+    def __iter__(self):
+        if not self.runs:
+            self.items.sort()
+            return iter(self.items)
+        self.spill()
+        return heapq.merge(*[read_run(run) for run in self.runs])
+
+    def close(self):
+        for run in self.runs:
+            os.remove(run)
+        self.runs = []
+        self.items = []
+
+
+def memory_limit(args):
+    '''Return the memory limit (in bytes) for external sorting requested by
+       the command-line arguments, or None to work in memory'''
+    limit = getattr(args, 'memory_limit', None)
+    return None if limit is None else limit * MB
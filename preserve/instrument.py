@@ -0,0 +1,90 @@
+import heapq
+import json
+import threading
+import time
+
+# the Timings collecting measurements, or None when profiling is disabled;
+# instrumented code checks this before taking any measurements
+TIMINGS = None
+
+# number of slowest files to keep
+SLOWEST = 10
+
+
+class Timings():
+    '''Aggregate timings of the stages of processing (discovery, stat, open,
+       read, digest updates, CSV writes, etc.), with the number of calls,
+       total and maximum time and the number of bytes handled by each, plus
+       the slowest individual files.'''
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.start = time.perf_counter()
+        self.stages = {}
+        self.slowest = []
+
+    def add(self, stage, seconds, bytes=0):
+        with self.lock:
+            totals = self.stages.get(stage)
+            if totals is None:
+                self.stages[stage] = [1, seconds, seconds, bytes]
+            else:
+                totals[0] += 1
+                totals[1] += seconds
+                totals[2] = max(totals[2], seconds)
+                totals[3] += bytes
+
+    def add_file(self, path, seconds, bytes=0):
+        '''Record the total time taken for one file'''
+        self.add('file', seconds, bytes)
+        with self.lock:
+            item = (seconds, str(path), bytes)
+            if len(self.slowest) < SLOWEST:
+                heapq.heappush(self.slowest, item)
+            else:
+                heapq.heappushpop(self.slowest, item)
+
+    def summary(self):
+        '''Return a dictionary summarizing the timings'''
+        stages = []
+        for stage, (calls, total, longest, bytes) in self.stages.items():
+            stages.append({'stage': stage,
+                           'calls': calls,
+                           'seconds': round(total, 6),
+                           'mean_ms': round(1000 * total / calls, 3),
+                           'max_ms': round(1000 * longest, 3),
+                           'bytes': bytes,
+                           'mb_per_sec': round(bytes / total / 10**6, 3) if bytes and total else None})
+        return {'wall_seconds': round(time.perf_counter() - self.start, 6),
+                'stages': sorted(stages, key=lambda s: s['seconds'], reverse=True),
+                'slowest_files': [{'path': path, 'seconds': round(seconds, 6), 'bytes': bytes}
+                                  for seconds, path, bytes in sorted(self.slowest, reverse=True)]}
+
+    def report(self, format='table'):
+        '''Format the summary as a table of text, or as JSON'''
+        summary = self.summary()
+        if format == 'json':
+            return json.dumps(summary, indent=2) + '\n'
+        lines = [f"Profile ({summary['wall_seconds']:.3f} s wall time)",
+                 f"{'STAGE':<16} {'CALLS':>10} {'SECONDS':>10} {'MEAN MS':>10} {'MAX MS':>10} {'MB/S':>10}"]
+        for s in summary['stages']:
+            rate = '' if s['mb_per_sec'] is None else f"{s['mb_per_sec']:.1f}"
+            lines.append(f"{s['stage']:<16} {s['calls']:>10} {s['seconds']:>10.3f} "
+                         f"{s['mean_ms']:>10.3f} {s['max_ms']:>10.3f} {rate:>10}")
+        if summary['slowest_files']:
+            lines.append('Slowest files:')
+            for n, f in enumerate(summary['slowest_files'], 1):
+                lines.append(f"  ({n}) {f['seconds']:.3f} s {f['bytes']} bytes {f['path']}")
+        return '\n'.join(lines) + '\n\n'
+
+
+def enable():
+    '''Start collecting timings, returning the Timings object'''
+    global TIMINGS
+    TIMINGS = Timings()
+    return TIMINGS
+
+
+def disable():
+    global TIMINGS
+    TIMINGS = None
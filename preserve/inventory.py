@@ -1,9 +1,15 @@
 import csv
 import os
 import sys
+import time
+from itertools import chain
 
-from .asset import Asset
-from .utils import get_inventory, list_files
+from . import instrument
+from .asset import BUFFER_SIZE, Asset
+from .cache import open_cache
+from .progress import Progress
+from .utils import FileCounter, iter_files, ordered_map
+from .writer import InventoryWriter, recover
 
 # === SUBCOMMAND =============================================================
 #         NAME: inventory
@@ -57,88 +63,204 @@ def inventory(args):
             "ERROR: The label and mount flags must be provided together.\n"
         )
 
-    # Get a list of all files in the search path.
-    all_files = list_files(PATH)
-    total = len(all_files)
-    files_to_check = all_files  # overriden if OUTFILE specified
-    existing_entries = []       # overriden if OUTFILE specified
+    # Determine the set of hash algorithms to run
+    known_algs = ['md5', 'sha1', 'sha256']
+    if args.algorithms == 'none':
+        # only the metadata of the files is read, never their contents
+        algs_to_run = []
+    elif args.algorithms:
+        algs_to_run = args.algorithms.split(',')
+        if any([alg not in known_algs for alg in algs_to_run]):
+            return (
+                "ERROR: Unknown hash algorithm specified.\n\n"
+                )
+    else:
+        algs_to_run = known_algs
+
+    # Walk the search path lazily, so that hashing begins while the tree is
+    # still being discovered; unless they are given, the totals for the
+    # progress display are counted in the background. A listing of the files
+    # (with their stat results) made beforehand can be supplied instead, e.g.
+    # by preserve.batch.
+    files = getattr(args, 'files', None)
+    files_to_check = iter_files(PATH) if files is None else iter(files)
+    resuming = False                   # overriden if OUTFILE exists
+    unmatched = set()                  # overriden if OUTFILE exists
     count = 0
+    done_bytes = 0
     sys.stderr.write("Checking path: {0}\n".format(PATH))
     if OUTFILE:
         sys.stderr.write("Writing to file: {0}\n".format(OUTFILE))
-        # If the output file exists, read it and resume the job.
-        if os.path.isfile(OUTFILE):
-            existing_entries = get_inventory(OUTFILE, args.label, args.mount)
-            all_keys = set().union(
-                *(e.__dict__.keys() for e in existing_entries)
-                )
-            # if the CSV file conforms to the pattern
-            all_keys.discard('relpath')
-            if all_keys.issubset([fname.lower() for fname in FIELDNAMES]):
-                files_done = [
-                    os.path.join(f.directory, f.filename) for f in existing_entries
-                    ]
-                # Handle a complete inventory ...
-                if files_done == files_to_check:
-                    return (
-                        "Inventory is already complete.\n"
-                        )
-                # or an erroneous partial inventory
-                elif set(files_done).difference(files_to_check):
-                    return (
-                        "ERROR: Existing file contains references " +
-                        "to files that are not found in the path " +
-                        "being inventoried.\n"
-                        )
-                # Create the set of remaining files to be checked
-                files_to_check = set(all_files).difference(files_done)
-            # Handle non-conforming CSV file
-            else:
+        # If the output file exists, read it and resume the job, keeping only
+        # the set of paths already checked (relative to the search path)
+        if os.path.isfile(OUTFILE) and os.path.getsize(OUTFILE) > 0:
+            resuming = True
+            # Handle non-conforming CSV file, before anything is changed
+            with open(OUTFILE, newline='') as existing:
+                columns = next(csv.reader(existing))
+            if not set(columns).issubset(FIELDNAMES) or \
+                    not {'DIRECTORY', 'FILENAME'}.issubset(columns):
                 return (
                     "ERROR: The specified output file is not a correctly " +
                     "formatted inventory CSV.\n"
                     )
-        # open line-buffered file handle
-        fh = open(OUTFILE, 'w+', 1)
+            # Discard an incomplete row left by an interrupted run
+            try:
+                removed = recover(OUTFILE)
+            except ValueError as err:
+                return (
+                    "ERROR: The existing inventory is inconsistent: {0}\n".format(err)
+                    )
+            if removed:
+                sys.stderr.write("Removed {0} bytes of an incomplete row\n".format(removed))
+            prefix = os.path.join(PATH, '')
+            files_done = set()
+            with open(OUTFILE, newline='') as existing:
+                reader = csv.reader(existing)
+                next(reader)
+                dircol = columns.index('DIRECTORY')
+                filecol = columns.index('FILENAME')
+                bytescol = columns.index('BYTES') if 'BYTES' in columns else None
+                for row in reader:
+                    if not row:
+                        continue
+                    # Handle a row that is missing some of its columns
+                    if len(row) < len(columns):
+                        return (
+                            "ERROR: The specified output file is not a correctly " +
+                            "formatted inventory CSV.\n"
+                            )
+                    path = os.path.join(row[dircol], row[filecol])
+                    # Handle an erroneous partial inventory
+                    if not path.startswith(prefix):
+                        return (
+                            "ERROR: Existing file contains references " +
+                            "to files that are not found in the path " +
+                            "being inventoried.\n"
+                            )
+                    files_done.add(path[len(prefix):])
+                    if bytescol is not None and row[bytescol].isdigit():
+                        done_bytes += int(row[bytescol])
+            # Append new rows using the columns of the existing file
+            FIELDNAMES = columns
+            sys.stderr.write("Resuming after {0} files\n".format(len(files_done)))
+            count = len(files_done)
+            # Skip the files already checked, preserving the order of the
+            # walk; any completed rows that the walk never reaches are left
+            # in unmatched, and reported once the walk is finished
+            unmatched = set(files_done)
+
+            def remaining(entries):
+                for e in entries:
+                    relpath = e.path[len(prefix):]
+                    if relpath in files_done:
+                        unmatched.discard(relpath)
+                    else:
+                        yield e
+            files_to_check = remaining(files_to_check)
+            # Handle a complete inventory
+            first = next(files_to_check, None)
+            if first is None:
+                if unmatched:
+                    return stale_rows_error(unmatched)
+                return (
+                    "Inventory is already complete.\n"
+                    )
+            files_to_check = chain([first], files_to_check)
+        # open file handle, appending to an existing inventory; rows are
+        # written in batches, with each batch synced to disk as a checkpoint
+        fh = open(OUTFILE, 'a' if resuming else 'w')
+        writer = InventoryWriter(fh, FIELDNAMES, path=OUTFILE, rows=count)
 
     # If no output file has been specified, write to stdout
     else:
         sys.stderr.write("Piping inventory to stdout\n")
         fh = sys.stdout
+        writer = InventoryWriter(fh, FIELDNAMES)
+
+    if not resuming:
+        writer.writeheader()
+
+    buffer_size = getattr(args, 'buffer_size', None) or BUFFER_SIZE
+    cache = open_cache(args)
+
+    counter = FileCounter(PATH, getattr(args, 'total', None), getattr(args, 'total_bytes', None))
+    counter.start()
+    progress = Progress(getattr(args, 'progress_label', None) or 'Files checked',
+                        files=count, bytes=done_bytes, mode=getattr(args, 'progress', 'text'))
+
+    def check_file(entry):
+        timings = instrument.TIMINGS
+        if timings is not None:
+            started = time.perf_counter()
+            stat = entry.stat()
+            timings.add('stat', time.perf_counter() - started)
+        else:
+            stat = entry.stat()
+        # the progress moves with each chunk hashed; the bytes of files
+        # that are not read (e.g. found in the cache) are added afterwards
+        hashed = []
+
+        def chunk(length):
+            hashed.append(length)
+            progress.update(files=0, bytes=length)
+        asset = Asset.from_filesystem(entry.path, PATH, args.label, args.mount, *algs_to_run,
+                                      buffer_size=buffer_size, cache=cache, stat=stat,
+                                      callback=chunk)
+        return asset, sum(hashed)
+
+    # Check each (remaining) file and generate metadata, hashing on a pool
+    # of worker threads if requested; results are yielded in walk order
+    workers = getattr(args, 'workers', None) or 1
+    try:
+        for a, hashed in ordered_map(check_file, files_to_check, workers):
+            write_entry(writer, BATCH, a, FIELDNAMES)
 
-    writer = csv.DictWriter(fh, fieldnames=FIELDNAMES)
-    writer.writeheader()
-    # Write the existing portion of the inventory to the output file
-    if OUTFILE:
-        for entry in existing_entries:
-            write_entry(writer, BATCH, entry, FIELDNAMES)
             count += 1
+            # Display the progress, once the totals are known
+            progress.total_files = counter.total
+            progress.total_bytes = counter.total_bytes
+            progress.update(bytes=a.bytes - hashed)
+    except BaseException:
+        # keep the rows completed so far, and the journal, for resuming
+        writer.checkpoint()
+        raise
 
-    # Determine the set of hash algorithms to run
-    known_algs = ['md5', 'sha1', 'sha256']
-    if args.algorithms:
-        algs_to_run = args.algorithms.split(',')
-        if any([alg not in known_algs for alg in algs_to_run]):
-            return (
-                "ERROR: Unknown hash algorithm specified.\n\n"
+    # Report the final progress and results, and close the file handle
+    writer.close()
+    counter.join()
+    progress.total_files = counter.total
+    progress.total_bytes = counter.total_bytes
+    progress.close()
+    if unmatched:
+        # the walk has been completed, but the existing inventory was made
+        # from a different set of files
+        if cache is not None:
+            cache.close()
+        return stale_rows_error(unmatched)
+    sys.stderr.write('Inventory complete!\n\n')
+    if cache is not None:
+        cache.close()
+        if cache.mismatches:
+            sys.stderr.write(
+                f"WARNING: {len(cache.mismatches)} files differ from their cached checksums:\n"
                 )
-    else:
-        algs_to_run = known_algs
-    # Check each (remaining) file and generate metadata
-    for f in files_to_check:
-        a = Asset().from_filesystem(f, PATH, args.label, args.mount, *algs_to_run)
-        write_entry(writer, BATCH, a, FIELDNAMES)
-
-        count += 1
-        # Display a running counter
-        sys.stderr.write(
-            "\rFiles checked: {0}/{1}".format(count, total)
-            )
+            for n, (path, algorithms) in enumerate(cache.mismatches, 1):
+                sys.stderr.write(f"  ({n}) {path} ({', '.join(algorithms)})\n")
+            sys.stderr.write('\n')
 
-    # Clear the counter, report results, and close file handle (it not stdout)
-    sys.stderr.write('\nInventory complete!\n\n')
-    if fh != sys.stdout:
-        fh.close()
+
+def stale_rows_error(unmatched, limit=10):
+    '''Return the error for an existing inventory that lists files that are
+       not found in the path being inventoried'''
+    listing = ''.join(f"  {path}\n" for path in sorted(unmatched)[:limit])
+    if len(unmatched) > limit:
+        listing += f"  ... and {len(unmatched) - limit} more\n"
+    return (
+        "ERROR: Existing file contains references " +
+        f"to {len(unmatched)} files that are not found in the path " +
+        "being inventoried:\n" + listing
+        )
 
 
 def write_entry(writer, batch, entry, fieldnames):
@@ -147,4 +269,4 @@ def write_entry(writer, batch, entry, fieldnames):
     '''
     # Ensure that the entry include the "batch" field
     entry.batch = batch
-    writer.writerow({k.upper(): v for k, v in entry.__dict__.items() if k.upper() in fieldnames})
+    writer.writerow({k.upper(): v for k, v in entry.as_dict().items() if k.upper() in fieldnames})
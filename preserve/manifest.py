@@ -3,69 +3,128 @@ import os
 import re
 
 from .asset import Asset
-from .utils import list_files
+from .utils import iter_files
 
 
-class Manifest(list):
+def common_root(root, path):
+    '''Given the directory prefix (ending with a slash) shared by the paths
+       seen so far, return the prefix shared with one more path. This is
+       usually a single startswith() test, as most paths share the root.'''
+    if root is None:
+        return path[:path.rfind('/') + 1]
+    while not path.startswith(root):
+        root = root[:root.rfind('/', 0, len(root) - 1) + 1]
+    return root
+
+
+class Manifest():
     '''Class representing a set of Asset objects in a particular
-       storage location'''
+       storage location. The assets are not held in memory: they are
+       parsed lazily from the file (or read from the directory) each time
+       the manifest is iterated. For a directory, only the files' metadata
+       is read unless hash algorithms are given.'''
     CSV_MARKERS = ["Key", "Filename", "KEY", "FILENAME"]
 
-    def __init__(self, path):
+    def __init__(self, path, algorithms=()):
         self.path = path
+        self.algorithms = algorithms
+        self.format = None
+        self._root = None
+        self._length = None
         if os.path.isdir(self.path):
             self.source = "directory"
-            self.root = self.path
-            self.read_from_dir()
+            self._root = os.path.join(os.path.abspath(self.path), '')
         elif os.path.isfile(self.path):
             self.source = "file"
-            self.read_from_file()
-            self.root = os.path.commonpath([a.path for a in self]) + '/'
-        for asset in self:
-            asset.relpath = re.sub(self.root, '', asset.path)
+            self.sniff()
+
+    def __iter__(self):
+        if self.source == "file":
+            # every path begins with the root, so slicing it off is enough
+            start = len(self.root)
+            for asset in self.assets():
+                asset.relpath = asset.path[start:]
+                yield asset
+        else:
+            yield from self.assets()
+
+    def __len__(self):
+        if self._length is None:
+            self.scan()
+        return self._length
+
+    @property
+    def root(self):
+        '''The directory common to all the assets in the manifest'''
+        if self._root is None:
+            self.scan()
+        return self._root
+
+    def scan(self):
+        '''Make a single pass over the manifest to count the assets and
+           find the root directory that they have in common'''
+        length = 0
+        if self.source == "directory":
+            length = sum(1 for entry in iter_files(self.path))
+        else:
+            root = None
+            for asset in self.assets():
+                length += 1
+                root = common_root(root, asset.path)
+            # relative paths may have no directory in common at all
+            self._root = root or ''
+        self._length = length
+
+    def sniff(self):
+        '''Examine the first line of the input file to determine its format'''
+        with open(self.path, 'r') as f:
+            headline = f.readline().strip('\n')
+        if headline == "IBM Tivoli Storage Manager":
+            self.format = "TSM"
+        elif any([m in headline for m in self.CSV_MARKERS]):
+            if '\t' in headline:
+                self.format = "TSV"
+                self.delimiter = '\t'
+            else:
+                self.format = "CSV"
+                self.delimiter = ','
+
+    def assets(self):
+        '''Generate the assets in the manifest, from the appropriate source'''
+        if self.source == "directory":
+            yield from self.read_from_dir()
+        elif self.source == "file":
+            yield from self.read_from_file()
 
     def read_from_file(self):
-        '''Examine input file and call appropriate parser'''
+        '''Stream the input file through the appropriate parser'''
         with open(self.path, 'r') as f:
-            self.rawlines = [line.strip('\n') for line in f]
-            headline = self.rawlines[0]
-            if headline == "IBM Tivoli Storage Manager":
-                self.format = "TSM"
-                self.parse_tsm()
-            elif any([m in headline for m in self.CSV_MARKERS]):
-                if '\t' in headline:
-                    self.format = "TSV"
-                    self.delimiter = '\t'
-                else:
-                    self.format = "CSV"
-                    self.delimiter = ','
-                self.parse_csv()
+            if self.format == "TSM":
+                yield from self.parse_tsm(f)
+            elif self.format in ("CSV", "TSV"):
+                yield from self.parse_csv(f)
 
     def read_from_dir(self):
-        '''Read files on disk and populate manifest'''
-        for f in list_files(self.path):
-            self.append(Asset().from_filesystem(f, self.root, label=None, mount_path=None))
+        '''Read files on disk and generate assets'''
+        root = os.path.abspath(self.path)
+        for entry in iter_files(root):
+            yield Asset.from_filesystem(entry.path, root, None, None, *self.algorithms,
+                                        stat=entry.stat())
 
-    def parse_tsm(self):
+    def parse_tsm(self, lines):
         '''Data parser function for reading data from Tivoli
            Storage Manager Report'''
         r = r"Normal File-->\W+([\d,]+)\W(\\.+) \[Sent\]$"
         p = re.compile(r)
-        results = []
-        for line in self.rawlines:
-            m = p.search(line)
+        for line in lines:
+            m = p.search(line.rstrip('\n'))
             if m:
                 bytes = int(m.group(1).replace(',', ''))
                 path = m.group(2).replace('\\', '/')
                 filename = os.path.basename(path)
-                self.append(Asset(path=path, filename=filename, bytes=bytes))
+                yield Asset(path=path, filename=filename, bytes=bytes)
 
-    def parse_csv(self):
+    def parse_csv(self, lines):
         '''Data parser for reading data from csv'''
-        for marker in self.CSV_MARKERS:
-            if marker in self.rawlines[0]:
-                filenamecol = marker
-                dircol = "DIRECTORY" if marker.isupper() else "Directory"
-                break
-        for row in csv.DictReader(self.rawlines, delimiter=self.delimiter):
-            self.append(Asset().from_csv(**row))
+        for row in csv.DictReader(lines, delimiter=self.delimiter):
+            yield Asset.from_csv(**row)
@@ -0,0 +1,104 @@
+import json
+import sys
+import threading
+import time
+from datetime import timedelta
+
+from .utils import file_size
+
+# minimum number of seconds between reports, for each output mode
+INTERVALS = {'text': 0.5, 'json': 10}
+
+
+class Progress():
+    '''Rate-limited progress display for long-running operations, tracking
+       the number of files and bytes processed against the totals (when
+       known), with throughput in MB/s and files/s and an estimated time
+       remaining. Reports are written to stderr as a single updating line
+       of text, or as JSON lines for monitoring ("json"), or not at all
+       ("none"). Updates may come from several threads at once.'''
+
+    def __init__(self, label, total_files=None, total_bytes=None, files=0, bytes=0,
+                 mode='text', interval=None, stream=None):
+        self.label = label
+        self.total_files = total_files
+        self.total_bytes = total_bytes
+        self.files = files
+        self.bytes = bytes
+        self.mode = mode
+        self.interval = INTERVALS.get(mode, 0) if interval is None else interval
+        self.stream = stream or sys.stderr
+        # rates are calculated from the work done in this run only
+        self.initial = (files, bytes)
+        self.start = time.monotonic()
+        self.last = None
+        self.width = 0
+        self.lock = threading.Lock()
+
+    def update(self, files=1, bytes=0):
+        '''Record that more files and/or bytes have been processed, and
+           report progress if the reporting interval has passed'''
+        with self.lock:
+            self.files += files
+            self.bytes += bytes
+            now = time.monotonic()
+            if self.last is None or now - self.last >= self.interval:
+                self.report(now)
+
+    def status(self, now=None):
+        '''Return a dictionary summarizing the progress so far'''
+        elapsed = (now or time.monotonic()) - self.start
+        files_done = self.files - self.initial[0]
+        bytes_done = self.bytes - self.initial[1]
+        files_rate = files_done / elapsed if elapsed > 0 else 0
+        bytes_rate = bytes_done / elapsed if elapsed > 0 else 0
+        eta = None
+        if self.total_bytes and bytes_rate > 0:
+            eta = max(self.total_bytes - self.bytes, 0) / bytes_rate
+        elif self.total_files and files_rate > 0:
+            eta = max(self.total_files - self.files, 0) / files_rate
+        return {'label': self.label,
+                'files': self.files,
+                'total_files': self.total_files,
+                'bytes': self.bytes,
+                'total_bytes': self.total_bytes,
+                'elapsed': round(elapsed, 3),
+                'files_per_sec': round(files_rate, 3),
+                'bytes_per_sec': round(bytes_rate, 3),
+                'eta': None if eta is None else round(eta, 3)}
+
+    def format(self, status):
+        '''Format a status dictionary as a line of text'''
+        total_files = '?' if status['total_files'] is None else status['total_files']
+        parts = [f"{status['label']}: {status['files']}/{total_files}"]
+        if status['bytes'] or status['total_bytes']:
+            done = file_size(status['bytes'])
+            if status['total_bytes']:
+                percent = 100 * status['bytes'] / status['total_bytes']
+                parts.append(f"{done}/{file_size(status['total_bytes'])} ({percent:.1f}%)")
+            else:
+                parts.append(done)
+            parts.append(f"{status['bytes_per_sec'] / 10**6:.1f} MB/s")
+        parts.append(f"{status['files_per_sec']:.1f} files/s")
+        if status['eta'] is not None:
+            parts.append(f"ETA {timedelta(seconds=int(status['eta']))}")
+        return ', '.join(parts)
+
+    def report(self, now=None):
+        '''Write out the current progress'''
+        self.last = now or time.monotonic()
+        if self.mode == 'text':
+            line = self.format(self.status(self.last))
+            # pad to overwrite any longer line written previously
+            self.width = max(self.width, len(line))
+            self.stream.write(f"\r{line:<{self.width}}")
+            self.stream.flush()
+        elif self.mode == 'json':
+            self.stream.write(json.dumps(self.status(self.last)) + '\n')
+            self.stream.flush()
+
+    def close(self):
+        '''Write out the final progress'''
+        self.report()
+        if self.mode == 'text':
+            self.stream.write('\n')
@@ -1,9 +1,18 @@
 import csv
 import os
 import sys
+import threading
+import time
+from collections import deque, namedtuple
+from concurrent.futures import Future, ThreadPoolExecutor
+from stat import S_ISDIR
 
+from . import instrument
 from .asset import Asset
 
+# number of directories read concurrently when walking a tree
+WALK_WORKERS = 8
+
 
 def header(title):
     '''Generate a title header box for console output.'''
@@ -51,17 +60,187 @@ def human_readable(bytes):
     return False
 
 
+def scan_directory(path, prune_hidden_files=True, prune_hidden_dirs=True):
+    '''Read a single directory, returning a list of DirEntry objects for its
+       files and a list of the paths of its subdirectories (not following
+       symlinks), optionally pruning out those whose names begin with dot.'''
+    timings = instrument.TIMINGS
+    if timings is not None:
+        started = time.perf_counter()
+    files = []
+    subdirs = []
+    try:
+        with os.scandir(path) as entries:
+            for entry in entries:
+                hidden = entry.name.startswith('.')
+                try:
+                    is_dir = entry.is_dir()
+                except OSError:
+                    is_dir = False
+                if not is_dir:
+                    if not (hidden and prune_hidden_files):
+                        files.append(entry)
+                elif not entry.is_symlink() and not (hidden and prune_hidden_dirs):
+                    subdirs.append(entry.path)
+    except OSError:
+        # unreadable directories are skipped, as with os.walk
+        pass
+    if timings is not None:
+        timings.add('discovery', time.perf_counter() - started)
+    return files, subdirs
+
+
+def iter_files(dir_path, prune_hidden_files=True, prune_hidden_dirs=True, workers=WALK_WORKERS,
+               directories=None):
+    '''Generate a DirEntry for each file in a directory tree, in the same
+       order as os.walk, pruning out the hidden files & dirs (i.e. those that
+       begin with dot). Files are yielded as soon as their directory has been
+       read, and each DirEntry caches the result of its stat() call. If a
+       list of directories is given, the (path, stat) of each directory
+       walked is appended to it, as stat'ed just before it is read.
+
+       With more than one worker, the directories that the walk will visit
+       next are read ahead concurrently on a thread pool, which hides the
+       latency of network filesystems without changing the order.'''
+    def scan(path):
+        if directories is not None:
+            try:
+                directories.append((os.fspath(path), os.stat(path)))
+            except OSError:
+                pass
+        return scan_directory(path, prune_hidden_files, prune_hidden_dirs)
+
+    if workers <= 1:
+        stack = [dir_path]
+        while stack:
+            files, subdirs = scan(stack.pop())
+            yield from files
+            stack.extend(reversed(subdirs))
+        return
+
+    # the stack holds paths, or futures for those already being read; the
+    # top of the stack is the next directory to visit
+    window = workers * 4
+    stack = [dir_path]
+    executor = ThreadPoolExecutor(max_workers=workers)
+    try:
+        while stack:
+            for n in range(max(0, len(stack) - window), len(stack)):
+                if not isinstance(stack[n], Future):
+                    stack[n] = executor.submit(scan, stack[n])
+            files, subdirs = stack.pop().result()
+            yield from files
+            stack.extend(reversed(subdirs))
+    finally:
+        for item in stack:
+            if isinstance(item, Future):
+                item.cancel()
+        executor.shutdown(wait=True)
+
+
 def list_files(dir_path):
     '''Return a list of files in a directory tree, pruning out the
        hidden files & dirs (i.e. those that begin with dot).'''
-    result = []
-    for root, dirs, files in os.walk(dir_path):
-        # prune directories beginning with dot
-        dirs[:] = [d for d in dirs if not d.startswith('.')]
-        # prune files beginning with dot
-        files[:] = [f for f in files if not f.startswith('.')]
-        result.extend([os.path.join(root, f) for f in files])
-    return result
+    return [entry.path for entry in iter_files(dir_path)]
+
+
+class FileCounter(threading.Thread):
+    '''Count the files and bytes in a directory tree in a background thread,
+       so that processing can begin before the totals are known. If the
+       totals are already known, no counting is done.'''
+
+    def __init__(self, dir_path, total=None, total_bytes=None):
+        super().__init__(daemon=True)
+        self.dir_path = dir_path
+        self.total = total
+        self.total_bytes = total_bytes
+
+    def run(self):
+        if self.total is None or self.total_bytes is None:
+            files = 0
+            bytes = 0
+            for entry in iter_files(self.dir_path):
+                files += 1
+                try:
+                    bytes += entry.stat().st_size
+                except OSError:
+                    pass
+            self.total, self.total_bytes = files, bytes
+
+
+# the stat fields used when inventorying a file
+FileStat = namedtuple('FileStat', 'st_mode st_dev st_ino st_size st_mtime_ns st_mtime')
+
+LISTING_FIELDS = ['PATH', 'MODE', 'DEV', 'INO', 'SIZE', 'MTIME_NS']
+
+
+class FileEntry():
+    '''Stand-in for an os.DirEntry, for files read from a saved listing'''
+
+    def __init__(self, path, stat):
+        self.path = path
+        self.name = os.path.basename(path)
+        self._stat = stat
+
+    def stat(self):
+        return self._stat
+
+
+def write_listing(path, entries, directories=()):
+    '''Write the paths and stat results of the given entries to a CSV
+       listing, replacing any previous listing atomically, and generate
+       the entries as they are written. The (path, stat) pairs of the
+       directories walked (see iter_files) are written after the files, so
+       that changes to the tree can be detected later.'''
+    with open(path + '.tmp', 'w', newline='') as handle:
+        writer = csv.writer(handle)
+        writer.writerow(LISTING_FIELDS)
+        for entry in entries:
+            stat = entry.stat()
+            writer.writerow([entry.path, stat.st_mode, stat.st_dev, stat.st_ino,
+                             stat.st_size, stat.st_mtime_ns])
+            yield entry
+        for directory, stat in directories:
+            writer.writerow([directory, stat.st_mode, stat.st_dev, stat.st_ino,
+                             stat.st_size, stat.st_mtime_ns])
+    os.replace(path + '.tmp', path)
+
+
+def read_listing(path, directories=False):
+    '''Generate FileEntry objects from a listing saved by write_listing, for
+       its files or (if requested) for its directories'''
+    with open(path, newline='') as handle:
+        reader = csv.reader(handle)
+        next(reader)
+        for row in reader:
+            mode, dev, ino, size, mtime_ns = (int(v) for v in row[1:])
+            if S_ISDIR(mode) == directories:
+                yield FileEntry(row[0], FileStat(mode, dev, ino, size, mtime_ns, mtime_ns / 1e9))
+
+
+def ordered_map(func, iterable, workers=1, window=None):
+    '''Yield func(item) for each item of iterable, in input order. With more
+       than one worker, calls run concurrently on a thread pool, with at most
+       window (default 4 x workers) results pending at any time.'''
+    if workers <= 1:
+        for item in iterable:
+            yield func(item)
+        return
+    window = window or workers * 4
+    pending = deque()
+    executor = ThreadPoolExecutor(max_workers=workers)
+    try:
+        for item in iterable:
+            pending.append(executor.submit(func, item))
+            if len(pending) >= window:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+    finally:
+        # drop queued work if the consumer stops early or a call fails
+        for future in pending:
+            future.cancel()
+        executor.shutdown(wait=True)
 
 
 def get_inventory(path, label, mount):
@@ -81,9 +260,9 @@ def get_inventory(path, label, mount):
     elif os.path.isdir(path):
         print("  => {0} is a directory.".format(path))
         result = []
-        for n, f in enumerate(list_files(path)):
+        for n, entry in enumerate(iter_files(path)):
             print("  => found {0} files.".format(n+1), end='\r')
-            a = Asset.from_filesystem(f, path, label, mount)
+            a = Asset.from_filesystem(entry.path, path, label, mount, stat=entry.stat())
             result.append(a)
         print()
         return result
@@ -1,4 +1,14 @@
+import csv
+import hashlib
+import json
+import os
+import struct
+import tempfile
+from itertools import groupby
+
+from .extsort import ExternalSorter, distinct, memory_limit
 from .manifest import Manifest
+from .progress import Progress
 
 # === SUBCOMMAND =============================================================
 #         NAME: verify
@@ -9,72 +19,344 @@ from .manifest import Manifest
 #               about them to the console.
 # ============================================================================
 
+# the signature of an asset is packed into a fixed-width record of its raw
+# md5 digest and its size, rather than kept as an Asset object
+RECORD = struct.Struct('>16sq')
+NO_DIGEST = bytes(16)
 
-def verify(args):
-    '''Verify the identity of two inventories (either stored or created on
-       the fly), by checking for the presence of all files and comparing the
-       checksums of each one.'''
+REPORT_FIELDS = ['status', 'relpath', 'md5_a', 'bytes_a', 'md5_b', 'bytes_b']
 
-    # Create dictionary from each manifest with key = path and val = signature
-    print(f"A. Loading data from {args.first}...")
-    A = {asset.relpath: asset for asset in Manifest(args.first)}
-    a_paths = set(A.keys())
-    a_unique = set([(asset.md5, asset.bytes) for asset in A.values()])
-    print(f"   - A has {len(A)} assets, {len(a_unique)} of which are unique")
+DIFFERENCES = [('modified', "asset(s) changed in place"),
+               ('added', "asset(s) added to B"),
+               ('deleted', "asset(s) removed from A"),
+               ('moved', "asset(s) moved but unchanged")]
 
-    print(f"B. Loading data from {args.second}...")
-    B = {asset.relpath: asset for asset in Manifest(args.second)}
-    b_paths = set(B.keys())
-    b_unique = set([(asset.md5, asset.bytes) for asset in B.values()])
-    print(f"   - B has {len(B)} assets, {len(b_unique)} of which are unique")
 
-    # Sort all asset paths into their respective sets
-    relpaths_both = a_paths.intersection(b_paths)
-    relpaths_only_a = a_paths.difference(b_paths)
-    relpaths_only_b = b_paths.difference(a_paths)
+def pack(md5, size):
+    '''Return the record for an asset with the given md5 and size (either of
+       which may be missing)'''
+    if not md5:
+        digest = NO_DIGEST
+    else:
+        try:
+            digest = bytes.fromhex(md5)
+        except ValueError:
+            digest = b''
+        if len(digest) != 16:
+            # not an md5 in hex: keep a digest of the value, so that equal
+            # values still match
+            digest = hashlib.md5(md5.encode()).digest()
+    try:
+        size = int(size)
+    except (TypeError, ValueError):
+        size = -1
+    return RECORD.pack(digest, size)
 
-    # Check identity of paths present in both manifests
-    unchanged = {p for p in relpaths_both if A[p] == B[p]}
-    modified = {p for p in relpaths_both if A[p] != B[p]}
 
-    # Examine asset paths present in one or the other, but not both, manifests
-    moved = {}
-    added = []
-    deleted = []
-    differences = []
-
-    for p in relpaths_only_a:
-        signature = (A[p].md5, A[p].bytes)
-        if signature not in b_unique:
-            deleted.append(p)
+def unpack(record):
+    '''Return the md5 (in hex) and size stored in a record, or None for
+       those that were missing'''
+    if record is None:
+        return None, None
+    digest, size = RECORD.unpack(record)
+    return (None if digest == NO_DIGEST else digest.hex()), (None if size < 0 else size)
+
+
+def read(path, label, mode):
+    '''Generate (relpath, record) pairs for the assets in a manifest (hashing
+       the files if it is a directory), reporting progress as it goes'''
+    progress = Progress(label, mode=mode)
+    for asset in Manifest(path, algorithms=['md5']):
+        yield asset.relpath, pack(asset.md5, asset.bytes)
+        progress.update(bytes=asset.bytes if isinstance(asset.bytes, int) else 0)
+    progress.close()
+
+
+class Verifier():
+    '''Compares two manifests using compact indexes. The first manifest is
+       read into a dictionary of relpath -> record, and the second is then
+       streamed against it, so that each asset is classified in a single
+       pass: the differences are generated as they are found, and unchanged
+       assets are only counted. The signatures (records) of each side are
+       kept in a set, to tell moved assets from added and deleted ones.'''
+
+    def __init__(self):
+        self.paths = {}
+        self.signatures = (set(), set())
+        self.counts = [0, 0]
+        self.unchanged = 0
+
+    def load(self, pairs):
+        '''Index the first manifest, given its (relpath, record) pairs; as
+           for the second manifest, every row is counted, even if its
+           relpath is repeated'''
+        signatures = self.signatures[0]
+        for relpath, record in pairs:
+            self.counts[0] += 1
+            self.paths[relpath] = record
+            signatures.add(record)
+
+    def differences(self, pairs):
+        '''Stream the (relpath, record) pairs of the second manifest against
+           the first, generating (status, relpath, record_a, record_b) for
+           each difference. The paths found in the second manifest are
+           removed from the index as they are matched, so if a relpath is
+           repeated, only its first row is compared with the first manifest
+           (where the last row of each relpath is kept), and the others are
+           reported as added or moved.'''
+        paths = self.paths
+        signatures = self.signatures[1]
+        second_only = []
+        for relpath, record in pairs:
+            self.counts[1] += 1
+            signatures.add(record)
+            other = paths.pop(relpath, None)
+            if other is None:
+                second_only.append((relpath, record))
+            elif other == record:
+                self.unchanged += 1
+            else:
+                yield 'modified', relpath, other, record
+
+        # the paths left in the index are missing from the second manifest
+        for relpath in sorted(paths):
+            record = paths[relpath]
+            yield ('moved' if record in signatures else 'deleted'), relpath, record, None
+        paths.clear()
+        for relpath, record in sorted(second_only, key=lambda pair: pair[0]):
+            yield ('moved' if record in self.signatures[0] else 'added'), relpath, None, record
+
+    def summary(self):
+        return {'assets_a': self.counts[0],
+                'unique_a': len(self.signatures[0]),
+                'assets_b': self.counts[1],
+                'unique_b': len(self.signatures[1]),
+                'unchanged': self.unchanged}
+
+
+class ExternalVerifier(Verifier):
+    '''Verifier for manifests too large to index in memory. The (relpath,
+       record) pairs of each manifest are sorted externally, both by relpath
+       and by record, in run files on disk. The two manifests are then
+       merge-joined by relpath, and the assets found on only one side are
+       merge-joined with the other side's records to tell moved assets from
+       added and deleted ones. The differences are the same as those found
+       by the Verifier, and are generated in the same order, except that
+       modified assets come in relpath order.'''
+
+    def __init__(self, memory_limit, tmpdir=None):
+        super().__init__()
+        # two sorters are filled at a time, so each has half of the memory
+        self.memory_limit = memory_limit // 2
+        self.tmpdir = tmpdir
+        self.by_path = [None, None]
+        self.by_record = [None, None]
+        self.unique = [0, 0]
+
+    def sorter(self):
+        return ExternalSorter(self.memory_limit, self.tmpdir)
+
+    def read(self, side, pairs):
+        # the rows are numbered, so that those with the same relpath stay
+        # in the order of the manifest
+        by_path = self.by_path[side] = self.sorter()
+        by_record = self.by_record[side] = self.sorter()
+        for row, (relpath, record) in enumerate(pairs):
+            by_path.add((relpath, row, record))
+            by_record.add(record)
+        self.unique[side] = sum(1 for record in distinct(by_record))
+
+    def sorted_paths(self, side):
+        '''Generate the (relpath, record) pairs of one side in relpath order,
+           and in the order of the manifest for repeated relpaths; only the
+           last row of each relpath is kept in the first manifest, as when
+           it is indexed in memory'''
+        if side == 1:
+            for relpath, row, record in self.by_path[1]:
+                yield relpath, record
+        else:
+            for relpath, group in groupby(self.by_path[0], key=lambda item: item[0]):
+                for relpath, row, record in group:
+                    pass
+                yield relpath, record
+
+    def load(self, pairs):
+        self.read(0, pairs)
+        self.counts[0] = len(self.by_path[0])
+
+    def differences(self, pairs):
+        self.read(1, pairs)
+        self.counts[1] = len(self.by_path[1])
+        first_only = self.sorter()
+        second_only = self.sorter()
+        first = self.sorted_paths(0)
+        second = self.sorted_paths(1)
+        a = next(first, None)
+        b = next(second, None)
+        while a is not None or b is not None:
+            if b is None or (a is not None and a[0] < b[0]):
+                first_only.add((a[1], a[0]))
+                a = next(first, None)
+            elif a is None or b[0] < a[0]:
+                second_only.add((b[1], b[0]))
+                b = next(second, None)
+            else:
+                if a[1] == b[1]:
+                    self.unchanged += 1
+                else:
+                    yield 'modified', a[0], a[1], b[1]
+                a = next(first, None)
+                b = next(second, None)
+
+        for side, one_sided in enumerate((first_only, second_only)):
+            results = self.sorter()
+            for record, relpath, found in semi_join(one_sided, distinct(self.by_record[1 - side])):
+                results.add((relpath, 'moved' if found else ('deleted', 'added')[side], record))
+            one_sided.close()
+            for relpath, status, record in results:
+                yield (status, relpath, record, None) if side == 0 else (status, relpath, None, record)
+            results.close()
+        for sorter in self.by_path + self.by_record:
+            sorter.close()
+
+    def summary(self):
+        summary = super().summary()
+        summary['unique_a'], summary['unique_b'] = self.unique
+        return summary
+
+
+def semi_join(pairs, records):
+    '''Given (record, relpath) pairs and distinct records, both in sorted
+       order, generate (record, relpath, found) for each pair, where found
+       is whether its record is one of the records'''
+    records = iter(records)
+    current = next(records, None)
+    for record, relpath in pairs:
+        while current is not None and current < record:
+            current = next(records, None)
+        yield record, relpath, current == record
+
+
+class Report():
+    '''Writes each difference found to a CSV or JSON file as soon as it is
+       found. A JSON report is a single object, with the list of differences
+       followed by a summary of the counts.'''
+
+    def __init__(self, path, format=None, first=None, second=None):
+        if format is None:
+            format = 'json' if path.lower().endswith('.json') else 'csv'
+        self.format = format
+        self.count = 0
+        self.handle = open(path, 'w', newline='')
+        if format == 'json':
+            self.handle.write(f'{{"first": {json.dumps(first)}, "second": {json.dumps(second)},\n'
+                              f' "differences": [')
         else:
-            moved.setdefault(signature, []).append(p)
+            self.writer = csv.writer(self.handle)
+            self.writer.writerow(REPORT_FIELDS)
 
-    for p in relpaths_only_b:
-        signature = (B[p].md5, B[p].bytes)
-        if signature not in a_unique:
-            added.append(p)
+    def write(self, status, relpath, a, b):
+        row = [status, relpath, *unpack(a), *unpack(b)]
+        if self.format == 'json':
+            separator = ',' if self.count else ''
+            self.handle.write(f'{separator}\n  {json.dumps(dict(zip(REPORT_FIELDS, row)))}')
         else:
-            moved.setdefault(signature, []).append(p)
-
-    # create a summary of all possible issues
-    if modified:
-        differences.append(("asset(s) changed in place", modified))
-    if added:
-        differences.append(("asset(s) added to B", added))
-    if deleted:
-        differences.append(("asset(s) removed from A", deleted))
-    if moved:
-        differences.append(("asset(s) moved but unchanged", moved))
-
-    # Report results, sorting assets by nature of detected difference
-    if unchanged == relpaths_both and not any(differences):
+            self.writer.writerow(row)
+        self.count += 1
+
+    def close(self, summary):
+        if self.format == 'json':
+            self.handle.write(f'\n ],\n "summary": {json.dumps(summary)}}}\n')
+        self.handle.close()
+
+
+def report_differences(verifier, differences, report=None):
+    '''Consume the differences, writing them to the report (if any) and
+       printing the results; the details are only printed when there is
+       no report to hold them.'''
+    counts = {status: 0 for status, _ in DIFFERENCES}
+    details = {status: [] for status, _ in DIFFERENCES}
+    moved = {}
+    b_printed = False
+    for status, relpath, a, b in differences:
+        if not b_printed and status != 'modified':
+            # the second manifest has been read once anything but a
+            # modification is found
+            print_second(verifier)
+            b_printed = True
+        counts[status] += 1
+        if status == 'moved':
+            # moved assets are grouped by their signature
+            relpaths = moved.setdefault(a or b, [])
+        else:
+            relpaths = details[status]
+        if report is not None:
+            report.write(status, relpath, a, b)
+        else:
+            relpaths.append(relpath)
+    if not b_printed:
+        print_second(verifier)
+
+    summary = verifier.summary()
+    summary.update(counts)
+    if report is not None:
+        report.close(summary)
+
+    if not any(counts.values()):
         print("=> SUCCESS! No differences found.")
+        return summary
+    print("=> Check complete! But possible problems were found.")
+    for status, description in DIFFERENCES:
+        if not counts[status]:
+            continue
+        count = len(moved) if status == 'moved' else counts[status]
+        print(f"=> {count} {description}:")
+        if report is not None:
+            continue
+        if status == 'moved':
+            for n, record in enumerate(sorted(moved), 1):
+                print(f"   ({n}) {unpack(record)}")
+                print(f"       {' --> '.join(moved[record])}")
+        else:
+            for n, relpath in enumerate(sorted(details[status]), 1):
+                print(f"   ({n}) {relpath}")
+    if report is not None:
+        print(f"=> Details of the differences written to {report.handle.name}")
+    return summary
+
+
+def print_second(verifier):
+    summary = verifier.summary()
+    print(f"   - B has {summary['assets_b']} assets, {summary['unique_b']} of which are unique")
+
+
+def verify(args):
+    '''Verify the identity of two inventories (either stored or created on
+       the fly), by checking for the presence of all files and comparing the
+       checksums of each one.'''
+    limit = memory_limit(args)
+    if limit is None:
+        verify_with(Verifier(), args)
     else:
-        print("=> Check complete! But possible problems were found.")
-        for diff in differences:
-            print(f"=> {len(diff[1])} {diff[0]}:")
-            for n, asset in enumerate(sorted(diff[1]), 1):
-                print(f"   ({n}) {asset}")
-                if type(diff[1]) == dict:
-                    print(f"       {' --> '.join(diff[1][asset])}")
+        # run files are removed with the temporary directory
+        with tempfile.TemporaryDirectory(prefix='preserve-', dir=getattr(args, 'tmpdir', None)) as tmpdir:
+            verify_with(ExternalVerifier(limit, tmpdir), args)
+
+
+def verify_with(verifier, args):
+    '''Verify the two inventories with the given Verifier'''
+    mode = getattr(args, 'progress', 'text')
+
+    print(f"A. Loading data from {args.first}...")
+    verifier.load(read(args.first, 'A. Assets loaded', mode))
+    summary = verifier.summary()
+    print(f"   - A has {summary['assets_a']} assets, {summary['unique_a']} of which are unique")
+
+    report = None
+    if getattr(args, 'report', None):
+        report = Report(args.report, getattr(args, 'report_format', None),
+                        os.path.abspath(args.first), os.path.abspath(args.second))
+
+    print(f"B. Loading data from {args.second}...")
+    differences = verifier.differences(read(args.second, 'B. Assets loaded', mode))
+    report_differences(verifier, differences, report)
@@ -0,0 +1,133 @@
+import csv
+import io
+import json
+import os
+import time
+
+from . import instrument
+
+# a checkpoint is made when any of these limits is reached
+CHECKPOINT_ROWS = 1000
+CHECKPOINT_BYTES = 1024 ** 2
+CHECKPOINT_SECONDS = 10
+
+
+def journal_path(path):
+    '''Return the path of the sidecar journal for an inventory file.'''
+    return f'{path}.journal'
+
+
+def read_journal(path):
+    '''Return the last checkpoint recorded for an inventory file, or None.'''
+    try:
+        with open(journal_path(path)) as handle:
+            return json.load(handle)
+    except (OSError, ValueError):
+        return None
+
+
+def recover(path):
+    '''Make an interrupted inventory file consistent before it is resumed.
+       Everything up to the last checkpoint in the journal is kept; after it,
+       only an incomplete final row (if any) is removed. Returns the number
+       of bytes removed, or raises ValueError if the file is shorter than
+       its last checkpoint.'''
+    journal = read_journal(path)
+    committed = journal['bytes'] if journal else 0
+    size = os.path.getsize(path)
+    if size < committed:
+        raise ValueError(
+            f'{path} is shorter than its last checkpoint ({size} < {committed} bytes)'
+            )
+    end = size
+    with open(path, 'rb+') as handle:
+        # search backwards from the end of the file for the last line ending
+        while end > committed:
+            start = max(committed, end - 64 * 1024)
+            handle.seek(start)
+            newline = handle.read(end - start).rfind(b'\n')
+            if newline >= 0:
+                end = start + newline + 1
+                break
+            end = start
+        if end < size:
+            handle.truncate(end)
+            handle.flush()
+            os.fsync(handle.fileno())
+    return size - end
+
+
+class InventoryWriter():
+    '''CSV writer for inventories that buffers rows in memory and writes them
+       in batches, by number of rows, bytes or elapsed time. When writing to
+       a file, each batch is fsynced and recorded as a checkpoint in a sidecar
+       journal, so that an interrupted inventory can always be resumed from
+       a consistent state (see recover).'''
+
+    def __init__(self, handle, fieldnames, path=None, rows=0,
+                 max_rows=CHECKPOINT_ROWS, max_bytes=CHECKPOINT_BYTES,
+                 max_seconds=CHECKPOINT_SECONDS, extrasaction='raise'):
+        self.handle = handle
+        self.path = path
+        self.rows = rows
+        self.max_rows = max_rows
+        self.max_bytes = max_bytes
+        self.max_seconds = max_seconds
+        self.buffer = io.StringIO()
+        self.writer = csv.DictWriter(self.buffer, fieldnames=fieldnames, extrasaction=extrasaction)
+        self.pending = 0
+        self.last_checkpoint = time.monotonic()
+
+    def writeheader(self):
+        '''Write the header, at once, so that the file is never left empty'''
+        self.writer.writeheader()
+        self.checkpoint()
+
+    def writerow(self, row):
+        timings = instrument.TIMINGS
+        if timings is not None:
+            started = time.perf_counter()
+            self.writer.writerow(row)
+            timings.add('csv write', time.perf_counter() - started)
+        else:
+            self.writer.writerow(row)
+        self.pending += 1
+        if self.pending >= self.max_rows or \
+                self.buffer.tell() >= self.max_bytes or \
+                time.monotonic() - self.last_checkpoint >= self.max_seconds:
+            self.checkpoint()
+
+    def checkpoint(self):
+        '''Write out the buffered rows and, for files, sync them to disk and
+           record the new checkpoint in the journal.'''
+        timings = instrument.TIMINGS
+        if timings is not None:
+            started = time.perf_counter()
+            size = self.buffer.tell()
+        self.handle.write(self.buffer.getvalue())
+        self.handle.flush()
+        self.rows += self.pending
+        self.buffer.seek(0)
+        self.buffer.truncate()
+        self.pending = 0
+        self.last_checkpoint = time.monotonic()
+        if self.path is not None:
+            os.fsync(self.handle.fileno())
+            journal = journal_path(self.path)
+            with open(f'{journal}.tmp', 'w') as handle:
+                json.dump({'rows': self.rows,
+                           'bytes': os.fstat(self.handle.fileno()).st_size,
+                           'time': time.time()}, handle)
+                handle.flush()
+                os.fsync(handle.fileno())
+            os.replace(f'{journal}.tmp', journal)
+        if timings is not None:
+            timings.add('checkpoint', time.perf_counter() - started, size)
+
+    def close(self):
+        '''Write out any remaining rows; once a file is complete and synced
+           its journal is no longer needed.'''
+        self.checkpoint()
+        if self.path is not None:
+            self.handle.close()
+            os.remove(journal_path(self.path))
@@ -26,3 +26,14 @@ def test_partition_by(filename, dest_dir):
     })
     mapping = fileset.partition_by(PARTITIONING_PATTERN, '/output')
     assert mapping[path] == f'/output/{dest_dir}/{filename}'
+
+
+def test_from_filesystem_reads_sizes(tmp_path):
+    (tmp_path / 'sub').mkdir()
+    (tmp_path / 'sub/scpa-000001-0001.tif').write_text("12345")
+    (tmp_path / '.DS_Store').write_text("hidden")
+
+    fileset = FileSet.from_filesystem(str(tmp_path))
+    assert fileset.bytes == 5
+    assert fileset[str(tmp_path / 'sub/scpa-000001-0001.tif')] == \
+        Asset('scpa-000001-0001.tif', None, 5)
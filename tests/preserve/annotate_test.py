@@ -0,0 +1,157 @@
+import argparse
+import csv
+import hashlib
+
+from preserve import annotate as annotate_module
+from preserve.annotate import annotate, examine_matching_file, scan_filesystem
+from tests.utils import create_temp_file
+
+
+def make_row(md5='', size=''):
+    return {'PATH': '', 'FILENAME': 'IMG_0001.JPG', 'BYTES': size,
+            'MD5': md5, 'SHA1': '', 'SHA256': '', 'storagepath': ''}
+
+
+def test_only_candidates_of_the_right_size_are_hashed(monkeypatch, tmp_path):
+    create_temp_file(tmp_path / 'a', 'IMG_0001.JPG', 'short')
+    create_temp_file(tmp_path / 'b', 'IMG_0001.JPG', 'a little longer')
+    target = create_temp_file(tmp_path / 'c', 'IMG_0001.JPG', 'exactly right')
+    calls = []
+    calculate_hashes = annotate_module.calculate_hashes
+
+    def counting(path, algorithms):
+        calls.append((path, algorithms))
+        return calculate_hashes(path, algorithms)
+    monkeypatch.setattr(annotate_module, 'calculate_hashes', counting)
+
+    md5 = hashlib.md5(b'exactly right').hexdigest()
+    row = examine_matching_file('IMG_0001.JPG', tmp_path, make_row(md5, '13'), scan_filesystem(tmp_path))
+
+    assert row['PATH'] == str(target)
+    assert row['SHA256'] == hashlib.sha256(b'exactly right').hexdigest()
+    # the only candidate of the right size is read once, for all of the
+    # checksums
+    assert calls == [(str(target), ['md5', 'sha1', 'sha256'])]
+
+
+def test_candidates_of_the_same_size_are_checked_with_the_stored_checksum(monkeypatch, tmp_path):
+    other = create_temp_file(tmp_path / 'a', 'IMG_0001.JPG', 'not the one')
+    target = create_temp_file(tmp_path / 'b', 'IMG_0001.JPG', 'the one, yes')
+    calls = []
+    calculate_hashes = annotate_module.calculate_hashes
+
+    def counting(path, algorithms):
+        calls.append((path, algorithms))
+        return calculate_hashes(path, algorithms)
+    monkeypatch.setattr(annotate_module, 'calculate_hashes', counting)
+
+    md5 = hashlib.md5(b'the one, yes').hexdigest()
+    row = examine_matching_file('IMG_0001.JPG', tmp_path, make_row(md5), scan_filesystem(tmp_path))
+
+    assert row['PATH'] == str(target)
+    assert row['SHA1'] == hashlib.sha1(b'the one, yes').hexdigest()
+    # the other candidate (if it was reached) was only hashed with md5
+    assert all(algorithms == ['md5'] for path, algorithms in calls if path == str(other))
+    assert [algorithms for path, algorithms in calls if path == str(target)] == \
+        [['md5'], ['sha1', 'sha256']]
+
+
+def test_a_file_with_a_different_checksum_is_not_a_match(tmp_path):
+    create_temp_file(tmp_path, 'IMG_0001.JPG', 'contents')
+    row = make_row(hashlib.md5(b'other contents').hexdigest())
+
+    assert examine_matching_file('IMG_0001.JPG', tmp_path, row, scan_filesystem(tmp_path))['PATH'] == ''
+
+
+def test_annotate_short_rows(tmp_path):
+    search = tmp_path / 'search'
+    target = create_temp_file(search, 'file.txt', 'contents')
+    md5 = hashlib.md5(b'contents').hexdigest()
+    inventory = create_temp_file(tmp_path, 'inventory.csv',
+                                 f'PATH,FILENAME,MD5,BYTES,SHA1,SHA256\n,file.txt,{md5}\n')
+    output = tmp_path / 'output.csv'
+    args = argparse.Namespace(inventory=str(inventory), root=str(search), output=str(output),
+                              cache=None, progress='none')
+    annotate(args)
+
+    row = next(csv.DictReader(output.open()))
+    assert row['PATH'] == str(target)
+    assert row['SHA1'] == hashlib.sha1(b'contents').hexdigest()
+
+
+def test_annotate_resumes_and_keeps_input_order(tmp_path):
+    search = tmp_path / 'search'
+    search.mkdir()
+    lines = ['PATH,FILENAME,BYTES,MD5,SHA1,SHA256']
+    for n in range(20):
+        create_temp_file(search, f'file{n}.txt', f'contents {n}')
+        lines.append(f',file{n}.txt,,{hashlib.md5(f"contents {n}".encode()).hexdigest()},,')
+    inventory = create_temp_file(tmp_path, 'inventory.csv', '\n'.join(lines) + '\n')
+    output = tmp_path / 'output.csv'
+    args = argparse.Namespace(inventory=str(inventory), root=str(search), output=str(output),
+                              workers=4, resume=False, cache=None, progress='none')
+    annotate(args)
+    complete = output.read_text()
+
+    # an interrupted run leaves some complete rows and part of another
+    output.write_text(''.join(complete.splitlines(keepends=True)[:8]) + '/trunc')
+    args.resume = True
+    annotate(args)
+
+    assert output.read_text() == complete
+    rows = list(csv.DictReader(complete.splitlines()))
+    assert [row['FILENAME'] for row in rows] == [f'file{n}.txt' for n in range(20)]
+    assert all(row['PATH'] == str(search / row['FILENAME']) for row in rows)
+
+
+def test_annotate_resumes_from_an_empty_output(tmp_path):
+    search = tmp_path / 'search'
+    create_temp_file(search, 'file.txt', 'contents')
+    inventory = create_temp_file(tmp_path, 'inventory.csv',
+                                 'PATH,FILENAME,BYTES,MD5,SHA1,SHA256\n,file.txt,8,,,\n')
+    output = tmp_path / 'output.csv'
+    output.write_text('')
+    args = argparse.Namespace(inventory=str(inventory), root=str(search), output=str(output),
+                              resume=True, cache=None, progress='none')
+    annotate(args)
+
+    rows = list(csv.DictReader(output.open()))
+    assert [row['PATH'] for row in rows] == [str(search / 'file.txt')]
+
+
+def test_annotate_by_checksum_finds_renamed_files(tmp_path):
+    search = tmp_path / 'search'
+    renamed = create_temp_file(search, 'renamed.txt', 'original contents')
+    md5 = hashlib.md5(b'original contents').hexdigest()
+    inventory = create_temp_file(tmp_path, 'inventory.csv',
+                                 f'PATH,FILENAME,BYTES,MD5,SHA1,SHA256\n,original.txt,17,{md5},,\n')
+    output = tmp_path / 'output.csv'
+    args = argparse.Namespace(inventory=str(inventory), root=str(search), output=str(output),
+                              by_checksum=True, cache=str(tmp_path / 'cache.sqlite'), progress='none')
+    annotate(args)
+    annotate(args)
+
+    row = next(csv.DictReader(output.open()))
+    assert row['PATH'] == str(renamed)
+    assert row['SHA256'] == hashlib.sha256(b'original contents').hexdigest()
+
+
+def test_annotate_by_checksum_finds_files_renamed_after_indexing(tmp_path):
+    search = tmp_path / 'search'
+    original = create_temp_file(search, 'original.txt', 'original contents')
+    md5 = hashlib.md5(b'original contents').hexdigest()
+    inventory = create_temp_file(tmp_path, 'inventory.csv',
+                                 f'PATH,FILENAME,BYTES,MD5,SHA1,SHA256\n,original.txt,17,{md5},,\n')
+    output = tmp_path / 'output.csv'
+    args = argparse.Namespace(inventory=str(inventory), root=str(search), output=str(output),
+                              by_checksum=True, cache=str(tmp_path / 'cache.sqlite'), progress='none')
+    annotate(args)
+
+    # renaming keeps the device, inode, size and mtime, so the cache still
+    # holds the digests, but under the old path
+    renamed = search / 'renamed.txt'
+    original.rename(renamed)
+    annotate(args)
+
+    row = next(csv.DictReader(output.open()))
+    assert row['PATH'] == str(renamed)
@@ -1,4 +1,8 @@
-from preserve.asset import Asset
+import hashlib
+
+import pytest
+
+from preserve.asset import Asset, calculate_etag, calculate_hashes
 from tests.utils import create_temp_file
 
 
@@ -8,3 +12,74 @@ def test_relpath_for_file_in_base_path_should_simply_be_filename(tmp_path):
 
     asset = Asset.from_filesystem(temp_file, tmp_path, None, None, *['md5', 'sha1', 'sha256'])
     assert filename == asset.relpath
+
+
+def test_etag_is_calculated_in_the_same_pass_as_other_digests(tmp_path):
+    contents = "0123456789" * 25
+    temp_file = create_temp_file(tmp_path, 'etag_test.txt', contents)
+
+    parts = [contents[i:i+100].encode() for i in range(0, len(contents), 100)]
+    part_digests = b''.join(hashlib.md5(p).digest() for p in parts)
+    expected_etag = f'{hashlib.md5(part_digests).hexdigest()}-{len(parts)}'
+
+    hashes = calculate_hashes(temp_file, ['md5', 'etag'], chunk_size=100)
+    assert hashes['md5'] == hashlib.md5(contents.encode()).hexdigest()
+    assert hashes['etag'] == expected_etag
+    assert calculate_etag(temp_file, 100) == expected_etag
+    assert calculate_etag(temp_file, 1000) == hashes['md5']
+
+
+def test_etag_of_empty_file_is_md5_of_empty_string(tmp_path):
+    temp_file = create_temp_file(tmp_path, 'empty.txt', '')
+    assert calculate_etag(temp_file, 100) == hashlib.md5(b'').hexdigest()
+
+
+def test_hashes_do_not_depend_on_buffer_size(tmp_path):
+    temp_file = create_temp_file(tmp_path, 'buffer_test.txt', "Buffer test " * 1000)
+
+    expected = calculate_hashes(temp_file, ['md5', 'sha1', 'sha256', 'etag'])
+    for buffer_size in [1, 7, 4096]:
+        assert calculate_hashes(temp_file, ['md5', 'sha1', 'sha256', 'etag'],
+                                buffer_size=buffer_size) == expected
+
+
+def test_callback_is_called_with_each_chunk_hashed(tmp_path):
+    temp_file = create_temp_file(tmp_path, 'chunks.txt', "0123456789" * 100)
+    chunks = []
+    calculate_hashes(temp_file, ['md5'], buffer_size=256, callback=chunks.append)
+    assert chunks == [256, 256, 256, 232]
+
+
+def test_buffer_size_must_be_positive(tmp_path):
+    temp_file = create_temp_file(tmp_path, 'buffer_test.txt', "Buffer test")
+    for buffer_size in [0, -1]:
+        with pytest.raises(ValueError):
+            calculate_hashes(temp_file, ['md5'], buffer_size=buffer_size)
+
+
+def test_asset_from_csv_uses_compact_representation():
+    row = {'PATH': '/data/dir/image.tif', 'DIRECTORY': '/data/dir', 'FILENAME': 'image.tif',
+           'BYTES': '1024', 'MTIME': '1600000000', 'MD5': 'abc', 'NOTES': 'scanned'}
+    asset = Asset.from_csv(**row)
+
+    assert not hasattr(asset, '__dict__')
+    assert asset.bytes == 1024
+    assert asset.mtime == 1600000000
+    assert asset.sha1 is None
+    assert asset.notes == 'scanned'
+    assert asset.as_dict() == {'path': '/data/dir/image.tif', 'directory': '/data/dir',
+                               'filename': 'image.tif', 'bytes': 1024, 'mtime': 1600000000,
+                               'md5': 'abc', 'notes': 'scanned'}
+    assert asset.directory is Asset.from_csv(**row).directory
+
+
+def test_asset_without_algorithms_only_reads_metadata(tmp_path, monkeypatch):
+    temp_file = create_temp_file(tmp_path, 'metadata.txt', "12345")
+
+    def fail(*args, **kwargs):
+        raise AssertionError("file contents should not be read")
+    monkeypatch.setattr('preserve.asset.calculate_hashes', fail)
+
+    asset = Asset.from_filesystem(temp_file, tmp_path, None, None)
+    assert asset.bytes == 5
+    assert asset.md5 is None and asset.etag is None
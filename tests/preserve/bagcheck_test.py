@@ -0,0 +1,140 @@
+import argparse
+import gzip
+import hashlib
+import io
+import tarfile
+
+from preserve.bagcheck import bagcheck, inspect, read_tar_tags
+from tests.utils import create_temp_file
+
+PAYLOAD = b'x' * 100_000
+
+
+def add_file(tar, name, contents):
+    info = tarfile.TarInfo(name)
+    info.size = len(contents)
+    tar.addfile(info, io.BytesIO(contents))
+
+
+def write_bag(path, root):
+    '''Write a gzipped bag with its tag files before a large payload file'''
+    manifest = f'{hashlib.md5(PAYLOAD).hexdigest()}  data/big.bin\n'.encode()
+    tagmanifest = f'{hashlib.md5(manifest).hexdigest()}  manifest-md5.txt\n'.encode()
+    with tarfile.open(path, 'w:gz') as tar:
+        add_file(tar, f'{root}bagit.txt', b'BagIt-Version: 0.97\n')
+        add_file(tar, f'{root}tagmanifest-md5.txt', tagmanifest)
+        add_file(tar, f'{root}manifest-md5.txt', manifest)
+        add_file(tar, f'{root}data/big.bin', PAYLOAD)
+
+
+def test_bag_root_is_found_from_the_archive(tmp_path):
+    path = tmp_path / 'named-differently.tar.gz'
+    write_bag(path, 'bag_20240101/')
+
+    root, tags = read_tar_tags(path)
+    assert root == 'bag_20240101/'
+    assert sorted(tags) == ['bagit.txt', 'manifest-md5.txt', 'tagmanifest-md5.txt']
+    assert inspect(str(path)) == {(hashlib.md5(PAYLOAD).hexdigest(), 'data/big.bin')}
+
+
+def test_reading_stops_once_the_manifests_are_read(tmp_path):
+    path = tmp_path / 'bag.tar.gz'
+    write_bag(path, '')
+    # cut the archive off in the middle of the payload: only the tag files
+    # at the start can be read
+    data = gzip.decompress(path.read_bytes())
+    path.write_bytes(gzip.compress(data[:len(data) // 2]))
+
+    root, tags = read_tar_tags(path)
+    assert root == ''
+    assert 'manifest-md5.txt' in tags
+
+
+def test_fixity_checks_payload_from_directory_and_tar(capsys, tmp_path):
+    bag = tmp_path / 'bag'
+    (bag / 'data').mkdir(parents=True)
+    create_temp_file(bag / 'data', 'one.txt', 'one')
+    create_temp_file(bag / 'data', 'two.txt', 'two')
+    create_temp_file(bag, 'bagit.txt', 'BagIt-Version: 0.97\n')
+    for alg in ('md5', 'sha256'):
+        create_temp_file(bag, f'manifest-{alg}.txt', ''.join(
+            f'{hashlib.new(alg, name.encode()).hexdigest()}  data/{name}.txt\n' for name in ('one', 'two')))
+    inventory = create_temp_file(tmp_path, 'inventory.csv', 'PATH,DIRECTORY,FILENAME,BYTES,MD5\n' + ''.join(
+        f'/mnt/x/{name}.txt,/mnt/x,{name}.txt,3,{hashlib.md5(name.encode()).hexdigest()}\n'
+        for name in ('one', 'two')))
+    archive = tmp_path / 'bag.tar.gz'
+    with tarfile.open(archive, 'w:gz') as tar:
+        tar.add(bag, arcname='bag')
+
+    for path in (bag, archive):
+        bagcheck(argparse.Namespace(inventory=str(inventory), bag=str(path), fixity=True, workers=2))
+        assert capsys.readouterr().out.splitlines()[-1] == " => Fixity check passed for all 2 payload files!"
+
+    (bag / 'data' / 'two.txt').write_text('TWO')
+    bagcheck(argparse.Namespace(inventory=str(inventory), bag=str(bag), fixity=True, workers=2))
+    output = capsys.readouterr().out
+    assert output.count("1 files with checksums that do not match") == 2
+    assert "1 inventory files that do not match the payload" in output
+
+
+def test_payload_files_named_like_tag_files_are_hashed(capsys, tmp_path):
+    # the bag is at the top of the archive, and its payload is itself a bag,
+    # whose tag files come first
+    payload = {'data/bagit.txt': b'BagIt-Version: 0.97\n', 'data/manifest-md5.txt': b'',
+               'data/image.tif': b'image'}
+    manifest = ''.join(f'{hashlib.md5(contents).hexdigest()}  {name}\n'
+                       for name, contents in payload.items()).encode()
+    archive = tmp_path / 'bag.tar'
+    with tarfile.open(archive, 'w') as tar:
+        for name, contents in payload.items():
+            add_file(tar, name, contents)
+        add_file(tar, 'bagit.txt', b'BagIt-Version: 0.97\n')
+        add_file(tar, 'manifest-md5.txt', manifest)
+
+    root, tags = read_tar_tags(archive)
+    assert root == ''
+    assert tags['manifest-md5.txt'] == manifest
+
+    bagcheck(argparse.Namespace(inventory=None, bag=str(archive), fixity=True))
+    assert capsys.readouterr().out.splitlines()[-1] == " => Fixity check passed for all 3 payload files!"
+
+
+def test_fixity_of_a_bag_without_a_payload_directory_fails(tmp_path):
+    bag = tmp_path / 'bag'
+    create_temp_file(bag, 'bagit.txt', 'BagIt-Version: 0.97\n')
+    create_temp_file(bag, 'manifest-md5.txt', '')
+
+    result = bagcheck(argparse.Namespace(inventory=None, bag=str(bag), fixity=True))
+    assert result.startswith("ERROR: Could not read bag")
+    assert "no payload directory" in result
+
+
+def test_inventory_md5s_are_checked_against_the_md5_manifest(capsys, tmp_path):
+    bag = tmp_path / 'bag'
+    create_temp_file(bag, 'manifest-md5.txt', f'{hashlib.md5(b"one").hexdigest()}  data/one.txt\n')
+    create_temp_file(bag / 'data', 'one.txt', 'one')
+    inventory = create_temp_file(tmp_path, 'inventory.csv', 'PATH,DIRECTORY,FILENAME,BYTES,MD5,SHA256\n'
+                                 f'/mnt/x/one.txt,/mnt/x,one.txt,3,{hashlib.md5(b"one").hexdigest()},'
+                                 f'{hashlib.sha256(b"one").hexdigest()}\n')
+
+    bagcheck(argparse.Namespace(inventory=str(inventory), bag=str(bag)))
+    output = capsys.readouterr().out
+    assert " => All files accounted for in bag!" in output
+    assert " => No extra files found in bag!" in output
+
+
+def test_fixity_of_tar_bags_with_other_manifests(capsys, tmp_path):
+    contents = b'payload'
+    manifest = f'{hashlib.sha512(contents).hexdigest()}  data/file.bin\n'.encode()
+    for manifest_first in (False, True):
+        archive = tmp_path / f'bag-{manifest_first}.tar'
+        with tarfile.open(archive, 'w') as tar:
+            add_file(tar, 'bag/bagit.txt', b'BagIt-Version: 0.97\n')
+            if manifest_first:
+                add_file(tar, 'bag/manifest-sha512.txt', manifest)
+            add_file(tar, 'bag/data/file.bin', contents)
+            if not manifest_first:
+                add_file(tar, 'bag/manifest-sha512.txt', manifest)
+
+        bagcheck(argparse.Namespace(inventory=None, bag=str(archive), fixity=True))
+        assert capsys.readouterr().out.splitlines()[-1] == " => Fixity check passed for all 1 payload files!"
@@ -0,0 +1,72 @@
+import os
+import threading
+import time
+
+import pytest
+
+from preserve.batch.__main__ import (Directory, current_entries, listing_is_current,
+                                     read_limits, schedule)
+from tests.utils import create_temp_file
+
+
+def test_schedule_respects_device_limit(tmp_path):
+    dirs = []
+    for n in range(6):
+        path = tmp_path / f'dir{n}'
+        path.mkdir()
+        dirs.append(Directory(str(path), filecount=1, bytecount=1, humanread='1 bytes'))
+
+    lock = threading.Lock()
+    running = []
+    peak = []
+
+    def run(dir):
+        with lock:
+            running.append(dir)
+            peak.append(len(running))
+        time.sleep(0.01)
+        with lock:
+            running.remove(dir)
+
+    results = list(schedule(dirs, run, workers=4, device_limit=2))
+
+    # all the directories are on the same device as tmp_path
+    assert sorted(d.dirname for d, result in results) == [f'dir{n}' for n in range(6)]
+    assert all(result is None for d, result in results)
+    assert max(peak) == 2
+
+
+def test_limits_of_zero_are_rejected(tmp_path):
+    assert read_limits({'WORKERS': 2}) == (2, 1, {})
+    with pytest.raises(SystemExit):
+        read_limits({'DEVICE_LIMIT': 0})
+    with pytest.raises(SystemExit):
+        read_limits({'DEVICE_LIMITS': {str(tmp_path): 0}})
+
+
+def test_saved_listing_is_checked_before_it_is_reused(tmp_path):
+    root = tmp_path / 'batch'
+    root.mkdir()
+    (root / 'empty').mkdir()
+    for n in range(3):
+        create_temp_file(root / 'dir', f'file{n}.txt', f'Contents {n}')
+    listing = str(tmp_path / 'batch.listing.csv')
+    directory = Directory(str(root), listing=listing)
+    assert (directory.filecount, directory.bytecount) == (3, 30)
+    assert listing_is_current(listing)
+
+    # a changed file is inventoried as it is now, and a deleted one reported
+    (root / 'dir' / 'file0.txt').write_text('Changed')
+    os.remove(root / 'dir' / 'file1.txt')
+    missing = []
+    entries = list(current_entries(listing, missing))
+    assert sorted((e.name, e.stat().st_size) for e in entries) == [('file0.txt', 7), ('file2.txt', 10)]
+    assert missing == [str(root / 'dir' / 'file1.txt')]
+
+    # removing (or adding) a file modifies its directory, even if it was empty
+    for path in (root / 'dir', root / 'empty'):
+        Directory(str(root), listing=listing)
+        assert listing_is_current(listing)
+        mtime = os.stat(path).st_mtime_ns + 10**9
+        os.utime(path, ns=(mtime, mtime))
+        assert not listing_is_current(listing)
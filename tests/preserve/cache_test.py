@@ -0,0 +1,54 @@
+import os
+
+from preserve.asset import Asset
+from preserve.cache import HashCache
+from tests.utils import create_temp_file
+
+
+def test_unchanged_file_is_read_from_cache(tmp_path, monkeypatch):
+    temp_file = create_temp_file(tmp_path / 'data', 'cached.txt', "Cache me")
+    cache = HashCache(tmp_path / 'cache.sqlite')
+
+    first = Asset.from_filesystem(temp_file, tmp_path, None, None, 'md5', 'sha256', cache=cache)
+
+    def fail(*args, **kwargs):
+        raise AssertionError("file should not be hashed again")
+    monkeypatch.setattr('preserve.asset.calculate_hashes', fail)
+    second = Asset.from_filesystem(temp_file, tmp_path, None, None, 'md5', 'sha256', cache=cache)
+
+    assert (first.md5, first.sha256) == (second.md5, second.sha256)
+    cache.close()
+
+
+def test_modified_file_is_not_read_from_cache(tmp_path):
+    temp_file = create_temp_file(tmp_path / 'data', 'cached.txt', "Cache me")
+    cache = HashCache(tmp_path / 'cache.sqlite')
+    Asset.from_filesystem(temp_file, tmp_path, None, None, 'md5', cache=cache)
+
+    temp_file.write_text("Changed")
+    os.utime(temp_file, ns=(0, 10**9))
+    stat = os.stat(temp_file)
+    assert cache.lookup(stat, ['md5']) is None
+    cache.close()
+
+
+def test_verify_mode_reports_mismatches(tmp_path):
+    temp_file = create_temp_file(tmp_path / 'data', 'cached.txt', "Cache me")
+    stat = os.stat(temp_file)
+    with HashCache(tmp_path / 'cache.sqlite') as cache:
+        cache.store(temp_file, stat, {'md5': '0' * 32})
+
+    with HashCache(tmp_path / 'cache.sqlite', verify=True) as cache:
+        Asset.from_filesystem(temp_file, tmp_path, None, None, 'md5', cache=cache)
+        assert cache.mismatches == [(temp_file, ['md5'])]
+
+
+def test_eviction_by_age_and_entries(tmp_path):
+    with HashCache(tmp_path / 'cache.sqlite') as cache:
+        for n in range(5):
+            temp_file = create_temp_file(tmp_path / 'data', f'file{n}.txt', str(n))
+            cache.store(temp_file, os.stat(temp_file), {'md5': str(n)})
+        cache.evict(max_entries=3)
+        assert cache.connection.execute('SELECT count(*) FROM hashes').fetchone()[0] == 3
+        cache.evict(max_age=-1)
+        assert cache.connection.execute('SELECT count(*) FROM hashes').fetchone()[0] == 0
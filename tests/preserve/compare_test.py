@@ -0,0 +1,41 @@
+import argparse
+
+from preserve.compare import compare
+from tests.utils import create_temp_file
+
+HEADER = "PATH,DIRECTORY,FILENAME,BYTES,MD5\n"
+
+
+def manifest_rows(root, files):
+    return ''.join(f"{root}/{name},{root},{name.split('/')[-1]},{size},\n" for name, size in files)
+
+
+def test_compare_by_relpath(capsys, tmp_path):
+    first = create_temp_file(tmp_path, 'first.csv', HEADER + manifest_rows(
+        '/mnt/a', [('x/one.txt', 1), ('x/two.txt', 2), ('three.txt', 3)]))
+    second = create_temp_file(tmp_path, 'second.csv', HEADER + manifest_rows(
+        '/backup/b', [('x/one.txt', 1), ('x/two.txt', 5), ('three.txt', 3)]))
+
+    compare(argparse.Namespace(first=str(first), other=[str(second)], relpath=True))
+
+    lines = capsys.readouterr().out.splitlines()
+    assert lines[0] == "2 values are common to all the supplied files:"
+    assert lines[1].startswith(" => Path 1: 1 values are unique")
+    assert lines[2] == "     (1) x/two.txt -- 2 bytes"
+    assert lines[3].startswith(" => Path 2: 1 values are unique")
+    assert lines[4] == "     (1) x/two.txt -- 5 bytes"
+
+
+def test_external_compare_matches_in_memory(capsys, tmp_path):
+    first = create_temp_file(tmp_path, 'first.csv', HEADER + manifest_rows(
+        '/mnt/a', [('x/one.txt', 1), ('x/two.txt', 2), ('three.txt', 3)]))
+    second = create_temp_file(tmp_path, 'second.csv', HEADER + manifest_rows(
+        '/backup/b', [('x/one.txt', 1), ('x/two.txt', 5), ('four.txt', 4)]))
+    args = argparse.Namespace(first=str(first), other=[str(second), str(first)], relpath=True)
+
+    compare(args)
+    in_memory = capsys.readouterr().out
+    args.memory_limit = 0
+    args.tmpdir = str(tmp_path)
+    compare(args)
+    assert capsys.readouterr().out == in_memory
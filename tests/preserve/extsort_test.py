@@ -0,0 +1,24 @@
+import random
+
+from preserve.extsort import ExternalSorter, distinct
+
+
+def test_sorter_spills_runs_and_merges_them(tmp_path):
+    items = [(f'path/{n:05}', n % 7) for n in range(5000)]
+    shuffled = items[:]
+    random.Random(0).shuffle(shuffled)
+
+    sorter = ExternalSorter(memory_limit=50_000, tmpdir=tmp_path)
+    for item in shuffled:
+        sorter.add(item)
+    assert sorter.runs
+    assert list(sorter) == items
+    assert list(sorter) == items
+    assert len(sorter) == 5000
+
+    sorter.close()
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_distinct():
+    assert list(distinct([1, 1, 2, 3, 3, 3])) == [1, 2, 3]
@@ -0,0 +1,34 @@
+import json
+
+from preserve import instrument
+from preserve.asset import Asset, calculate_hashes
+from tests.utils import create_temp_file
+
+
+def test_timings_record_each_stage_of_hashing_a_file(tmp_path):
+    temp_file = create_temp_file(tmp_path, 'timed.txt', "0123456789" * 100)
+
+    timings = instrument.enable()
+    try:
+        Asset.from_filesystem(temp_file, tmp_path, None, None, 'md5', 'sha256')
+    finally:
+        instrument.disable()
+
+    summary = json.loads(timings.report('json'))
+    stages = {s['stage']: s for s in summary['stages']}
+    assert {'stat', 'open', 'read', 'digest md5', 'digest sha256', 'file'} <= set(stages)
+    assert stages['digest md5']['bytes'] == 1000
+    assert summary['slowest_files'][0]['path'] == str(temp_file)
+
+
+def test_nothing_is_recorded_when_disabled(tmp_path, monkeypatch):
+    temp_file = create_temp_file(tmp_path, 'untimed.txt', "untimed")
+
+    calls = []
+    monkeypatch.setattr(instrument.Timings, '__init__', lambda self: calls.append('created'))
+    monkeypatch.setattr(instrument.Timings, 'add', lambda self, *args: calls.append(args))
+    Asset.from_filesystem(temp_file, tmp_path, None, None, 'md5', 'sha256')
+    calculate_hashes(temp_file, ['md5', 'etag'])
+
+    assert instrument.TIMINGS is None
+    assert calls == []
@@ -1,5 +1,6 @@
 import argparse
 import csv
+import json
 import os
 from datetime import datetime
 
@@ -44,6 +45,198 @@ def test_inventory_stdout(capsys, tmp_path):
     assert stdout_lines[1] == expected_file_line
 
 
+def test_inventory_workers_preserve_order(capsys, tmp_path):
+    '''
+    Hashing with a pool of workers should produce the same rows, in the same
+    order, as hashing the files one at a time.
+    '''
+    for n in range(20):
+        create_temp_file(tmp_path / f"dir{n % 3}", f"file{n}.txt", f"Contents {n}" * n)
+
+    outputs = []
+    for workers in [1, 4]:
+        inventory_args = argparse.Namespace(batch="TEST_BATCH",
+                                            outfile=None,
+                                            existing=None,
+                                            path=str(tmp_path),
+                                            algorithms=None,
+                                            label=None,
+                                            mount=None,
+                                            workers=workers)
+        inventory(inventory_args)
+        outputs.append(capsys.readouterr().out)
+
+    assert len(outputs[0].splitlines()) == 21
+    assert outputs[0] == outputs[1]
+
+
+def test_inventory_resume_appends_remaining_files_in_order(tmp_path):
+    '''
+    Resuming from a partial inventory should append only the missing rows,
+    producing the same file as an uninterrupted run.
+    '''
+    search_path = tmp_path / "search"
+    search_path.mkdir()
+    for n in range(10):
+        create_temp_file(search_path / f"dir{n % 3}", f"file{n}.txt", f"Contents {n}")
+
+    def run(outfile=None, existing=None):
+        inventory_args = argparse.Namespace(batch="TEST_BATCH",
+                                            outfile=outfile,
+                                            existing=existing,
+                                            path=str(search_path),
+                                            algorithms='md5',
+                                            label=None,
+                                            mount=None)
+        return inventory(inventory_args)
+
+    complete = tmp_path / "complete.csv"
+    run(outfile=str(complete))
+    lines = complete.read_text().splitlines(keepends=True)
+
+    partial = tmp_path / "partial.csv"
+    partial.write_text(''.join(lines[:4]))
+    run(existing=str(partial))
+
+    assert partial.read_text() == complete.read_text()
+    assert run(existing=str(partial)) == "Inventory is already complete.\n"
+
+
+def test_inventory_resume_reports_rows_not_found_in_the_walk(tmp_path):
+    '''
+    Resuming from a partial inventory that lists files that are no longer in
+    the search path should report them once the walk is complete.
+    '''
+    search_path = tmp_path / "search"
+    search_path.mkdir()
+    for n in range(5):
+        create_temp_file(search_path, f"file{n}.txt", f"Contents {n}")
+
+    def run(outfile=None, existing=None):
+        inventory_args = argparse.Namespace(batch="TEST_BATCH",
+                                            outfile=outfile,
+                                            existing=existing,
+                                            path=str(search_path),
+                                            algorithms='md5',
+                                            label=None,
+                                            mount=None)
+        return inventory(inventory_args)
+
+    partial = tmp_path / "partial.csv"
+    run(outfile=str(partial))
+    lines = partial.read_text().splitlines(keepends=True)
+    partial.write_text(''.join(lines[:3]))
+    removed = next(csv.DictReader(lines))['PATH']
+    os.remove(removed)
+
+    result = run(existing=str(partial))
+    assert result.startswith("ERROR: Existing file contains references to 1 files")
+    assert os.path.basename(removed) in result
+
+    # the same is reported when there is nothing left to inventory
+    assert run(existing=str(partial)).startswith("ERROR: Existing file contains references")
+
+
+def test_inventory_resume_skips_blank_rows_and_rejects_short_rows(tmp_path):
+    '''
+    Blank rows in an existing inventory are ignored, and short rows are
+    reported as a formatting error.
+    '''
+    search_path = tmp_path / "search"
+    search_path.mkdir()
+    for n in range(3):
+        create_temp_file(search_path, f"file{n}.txt", f"Contents {n}")
+
+    def run(outfile=None, existing=None):
+        inventory_args = argparse.Namespace(batch="TEST_BATCH",
+                                            outfile=outfile,
+                                            existing=existing,
+                                            path=str(search_path),
+                                            algorithms='md5',
+                                            label=None,
+                                            mount=None)
+        return inventory(inventory_args)
+
+    complete = tmp_path / "complete.csv"
+    run(outfile=str(complete))
+    lines = complete.read_text().splitlines(keepends=True)
+
+    partial = tmp_path / "partial.csv"
+    partial.write_text(lines[0] + '\n' + lines[1])
+    assert run(existing=str(partial)) is None
+    assert len(list(csv.DictReader(partial.open()))) == 3
+
+    partial.write_text(lines[0] + 'TEST_BATCH\n')
+    assert run(existing=str(partial)).startswith("ERROR: The specified output file is not")
+
+
+def test_inventory_resume_leaves_other_files_untouched(tmp_path):
+    '''
+    A file that is not an inventory should be rejected without any attempt to
+    recover it, which would remove its last (unterminated) line.
+    '''
+    search_path = tmp_path / "search"
+    create_temp_file(search_path, "file.txt", "Contents")
+    notes = tmp_path / "notes.txt"
+    notes.write_text("Some notes\nwithout a final newline")
+
+    inventory_args = argparse.Namespace(batch="TEST_BATCH",
+                                        outfile=None,
+                                        existing=str(notes),
+                                        path=str(search_path),
+                                        algorithms='md5',
+                                        label=None,
+                                        mount=None)
+    result = inventory(inventory_args)
+
+    assert result.startswith("ERROR: The specified output file is not")
+    assert notes.read_text() == "Some notes\nwithout a final newline"
+
+
+def test_inventory_progress_counts_the_totals_and_bytes_hashed(capsys, tmp_path):
+    '''
+    The totals of files and bytes are counted in the background, and every
+    byte hashed is counted.
+    '''
+    for n in range(3):
+        create_temp_file(tmp_path, f"file{n}.txt", "x" * 10 * (n + 1))
+
+    inventory_args = argparse.Namespace(batch="TEST_BATCH",
+                                        outfile=None,
+                                        existing=None,
+                                        path=str(tmp_path),
+                                        algorithms='md5',
+                                        label=None,
+                                        mount=None,
+                                        progress='json')
+    inventory(inventory_args)
+
+    reports = [json.loads(line) for line in capsys.readouterr().err.splitlines()
+               if line.startswith('{')]
+    assert (reports[-1]['files'], reports[-1]['total_files']) == (3, 3)
+    assert (reports[-1]['bytes'], reports[-1]['total_bytes']) == (60, 60)
+
+
+def test_inventory_without_hashing(capsys, tmp_path):
+    '''
+    With the "none" algorithm, only the metadata of the files is recorded.
+    '''
+    create_temp_file(tmp_path, "file.txt", "Contents")
+
+    inventory_args = argparse.Namespace(batch="TEST_BATCH",
+                                        outfile=None,
+                                        existing=None,
+                                        path=str(tmp_path),
+                                        algorithms='none',
+                                        label=None,
+                                        mount=None)
+    inventory(inventory_args)
+
+    row = next(csv.DictReader(capsys.readouterr().out.splitlines()))
+    assert row['BYTES'] == '8'
+    assert (row['MD5'], row['ETAG'], row['SHA1'], row['SHA256']) == ('', '', '', '')
+
+
 def generate_expected_values(temp_file):
     '''
     Generates the expected values for the given file
@@ -0,0 +1,12 @@
+import argparse
+
+import pytest
+
+from preserve.__main__ import positive_int
+
+
+def test_positive_int_rejects_zero_and_negative_values():
+    assert positive_int('4096') == 4096
+    for value in ['0', '-1']:
+        with pytest.raises(argparse.ArgumentTypeError):
+            positive_int(value)
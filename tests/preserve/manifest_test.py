@@ -0,0 +1,58 @@
+from preserve.manifest import Manifest
+from tests.utils import create_temp_file
+
+TSM_REPORT = """IBM Tivoli Storage Manager
+Command Line Backup-Archive Client Interface
+Normal File-->         1,234 \\\\server\\share\\batch\\dir\\image.tif [Sent]
+Normal File-->            12 \\\\server\\share\\batch\\notes.txt [Sent]
+Directory-->               0 \\\\server\\share\\batch\\dir [Sent]
+"""
+
+CSV_INVENTORY = """PATH,DIRECTORY,FILENAME,BYTES,MD5
+/mnt/drive/batch/dir/image.tif,/mnt/drive/batch/dir,image.tif,1234,abc
+/mnt/drive/batch/notes.txt,/mnt/drive/batch,notes.txt,12,def
+"""
+
+
+def test_tsm_report_is_parsed_lazily(tmp_path):
+    manifest = Manifest(str(create_temp_file(tmp_path, 'report.txt', TSM_REPORT)))
+    assert manifest.format == "TSM"
+    assert len(manifest) == 2
+    assets = list(manifest)
+    assert [a.filename for a in assets] == ['image.tif', 'notes.txt']
+    assert [a.bytes for a in assets] == [1234, 12]
+
+
+def test_csv_inventory_relpaths(tmp_path):
+    manifest = Manifest(str(create_temp_file(tmp_path, 'inventory.csv', CSV_INVENTORY)))
+    assert manifest.format == "CSV"
+    assert manifest.root == '/mnt/drive/batch/'
+    assert [a.relpath for a in manifest] == ['dir/image.tif', 'notes.txt']
+    # the manifest can be iterated more than once
+    assert len(list(manifest)) == len(manifest) == 2
+
+
+def test_directory_relpaths(tmp_path):
+    create_temp_file(tmp_path / 'dir', 'image.tif', "image")
+    create_temp_file(tmp_path, 'notes.txt', "notes")
+    manifest = Manifest(str(tmp_path) + '/')
+    assert sorted(a.relpath for a in manifest) == ['dir/image.tif', 'notes.txt']
+    assert len(manifest) == 2
+
+
+def test_relpaths_under_root_with_regex_characters(tmp_path):
+    rows = ''.join(f"/mnt/C++ (copy) [1]/{name},/mnt/C++ (copy) [1],{name},1,\n"
+                   for name in ['a.txt', 'b.txt'])
+    manifest = Manifest(str(create_temp_file(tmp_path, 'inventory.csv',
+                                             "PATH,DIRECTORY,FILENAME,BYTES,MD5\n" + rows)))
+    assert manifest.root == '/mnt/C++ (copy) [1]/'
+    assert [a.relpath for a in manifest] == ['a.txt', 'b.txt']
+
+
+def test_relpaths_of_relative_paths(tmp_path):
+    rows = ''.join(f"{directory}{name},{directory.rstrip('/')},{name},1,\n"
+                   for directory, name in [('', 'a.txt'), ('dir/', 'b.txt')])
+    manifest = Manifest(str(create_temp_file(tmp_path, 'inventory.csv',
+                                             "PATH,DIRECTORY,FILENAME,BYTES,MD5\n" + rows)))
+    assert manifest.root == ''
+    assert [a.relpath for a in manifest] == ['a.txt', 'dir/b.txt']
@@ -0,0 +1,39 @@
+import io
+import json
+
+from preserve.progress import Progress
+
+
+def test_progress_reports_are_rate_limited():
+    stream = io.StringIO()
+    progress = Progress('Files checked', total_files=1000, stream=stream, interval=3600)
+    for n in range(1000):
+        progress.update(bytes=1024)
+    progress.close()
+
+    reports = stream.getvalue().strip('\n').split('\r')[1:]
+    assert len(reports) == 2
+    assert reports[-1].startswith('Files checked: 1000/1000, 1000.0 KiB')
+
+
+def test_progress_json_lines():
+    stream = io.StringIO()
+    progress = Progress('Files checked', total_files=4, total_bytes=400, files=2, bytes=200,
+                        mode='json', stream=stream, interval=0)
+    progress.update(bytes=100)
+    progress.close()
+
+    statuses = [json.loads(line) for line in stream.getvalue().splitlines()]
+    assert len(statuses) == 2
+    assert statuses[-1]['files'] == 3
+    assert statuses[-1]['bytes'] == 300
+    assert statuses[-1]['total_bytes'] == 400
+    assert statuses[-1]['eta'] is not None
+
+
+def test_progress_none_writes_nothing():
+    stream = io.StringIO()
+    progress = Progress('Files checked', mode='none', stream=stream)
+    progress.update()
+    progress.close()
+    assert stream.getvalue() == ''
@@ -0,0 +1,55 @@
+import os
+
+from preserve.utils import iter_files, list_files, read_listing, write_listing
+from tests.utils import create_temp_file
+
+
+def test_list_files_matches_os_walk_order_and_prunes_hidden_files(tmp_path):
+    create_temp_file(tmp_path, 'top.txt', "top")
+    create_temp_file(tmp_path, '.hidden.txt', "hidden")
+    create_temp_file(tmp_path / '.hidden_dir', 'inside.txt', "hidden")
+    for name in ['b', 'a', 'c']:
+        create_temp_file(tmp_path / name, f'{name}.txt', name)
+        create_temp_file(tmp_path / name / 'nested', f'{name}-nested.txt', name)
+
+    expected = []
+    for root, dirs, files in os.walk(tmp_path):
+        dirs[:] = [d for d in dirs if not d.startswith('.')]
+        expected.extend([os.path.join(root, f) for f in files if not f.startswith('.')])
+
+    assert list_files(tmp_path) == expected
+    assert len(expected) == 7
+
+
+def test_iter_files_provides_stat_results(tmp_path):
+    create_temp_file(tmp_path, 'file.txt', "12345")
+    entries = list(iter_files(tmp_path))
+    assert [e.stat().st_size for e in entries] == [5]
+
+
+def test_concurrent_walk_preserves_order(tmp_path):
+    for n in range(30):
+        path = tmp_path / f'd{n % 5}'
+        path.mkdir(exist_ok=True)
+        create_temp_file(path / f'e{n % 4}', f'{n}.txt', str(n))
+
+    serial = [e.path for e in iter_files(tmp_path, workers=1)]
+    assert len(serial) == 30
+    for workers in [2, 8]:
+        assert [e.path for e in iter_files(tmp_path, workers=workers)] == serial
+
+
+def test_saved_listing_reproduces_walk(tmp_path):
+    create_temp_file(tmp_path / 'data', 'a.txt', "a")
+    create_temp_file(tmp_path / 'data' / 'sub', 'b.txt', "bb")
+    listing = str(tmp_path / 'listing.csv')
+
+    walked = list(write_listing(listing, iter_files(tmp_path / 'data')))
+    read = list(read_listing(listing))
+
+    assert [e.path for e in read] == [e.path for e in walked]
+    for saved, entry in zip(read, walked):
+        stat = entry.stat()
+        assert saved.name == entry.name
+        assert (saved.stat().st_size, saved.stat().st_mtime_ns, saved.stat().st_ino) == \
+            (stat.st_size, stat.st_mtime_ns, stat.st_ino)
@@ -0,0 +1,103 @@
+import argparse
+import csv
+import json
+import random
+
+from preserve.verify import verify
+from tests.utils import create_temp_file
+
+HEADER = "PATH,DIRECTORY,FILENAME,BYTES,MD5\n"
+
+
+def manifest_rows(root, files):
+    return ''.join(f"{root}/{name},{root},{name.split('/')[-1]},{size},{md5 * 32}\n"
+                   for name, size, md5 in files)
+
+
+def write_manifests(tmp_path):
+    first = create_temp_file(tmp_path, 'first.csv', HEADER + manifest_rows('/mnt/a', [
+        ('same.txt', 1, 'a'), ('changed.txt', 2, 'b'), ('old/moved.txt', 3, 'c'), ('gone.txt', 4, 'd')]))
+    second = create_temp_file(tmp_path, 'second.csv', HEADER + manifest_rows('/backup/b', [
+        ('same.txt', 1, 'a'), ('changed.txt', 2, 'e'), ('new/moved.txt', 3, 'c'), ('new.txt', 5, 'f')]))
+    return str(first), str(second)
+
+
+def test_verify_classifies_each_difference(capsys, tmp_path):
+    first, second = write_manifests(tmp_path)
+
+    verify(argparse.Namespace(first=first, second=second, progress='none'))
+
+    lines = capsys.readouterr().out.splitlines()
+    assert "   - B has 4 assets, 4 of which are unique" in lines
+    assert lines[lines.index("=> 1 asset(s) changed in place:") + 1] == "   (1) changed.txt"
+    assert lines[lines.index("=> 1 asset(s) added to B:") + 1] == "   (1) new.txt"
+    assert lines[lines.index("=> 1 asset(s) removed from A:") + 1] == "   (1) gone.txt"
+    moved = lines.index("=> 1 asset(s) moved but unchanged:")
+    assert lines[moved + 1] == f"   (1) ('{'c' * 32}', 3)"
+    assert lines[moved + 2] == "       old/moved.txt --> new/moved.txt"
+
+
+def test_verify_streams_differences_to_a_report(tmp_path):
+    first, second = write_manifests(tmp_path)
+
+    csv_report = tmp_path / 'report.csv'
+    verify(argparse.Namespace(first=first, second=second, progress='none', report=str(csv_report)))
+    with open(csv_report, newline='') as handle:
+        rows = {row['relpath']: row for row in csv.DictReader(handle)}
+    assert {r['status'] for r in rows.values()} == {'modified', 'added', 'deleted', 'moved'}
+    assert rows['changed.txt']['md5_a'] == 'b' * 32
+    assert rows['changed.txt']['md5_b'] == 'e' * 32
+    assert rows['new/moved.txt']['bytes_b'] == '3'
+
+    json_report = tmp_path / 'report.json'
+    verify(argparse.Namespace(first=first, second=second, progress='none', report=str(json_report)))
+    report = json.loads(json_report.read_text())
+    assert len(report['differences']) == 5
+    assert report['summary']['unchanged'] == 1
+    assert report['summary']['moved'] == 2
+
+
+def test_external_verify_finds_the_same_differences(capsys, tmp_path):
+    first, second = write_manifests(tmp_path)
+
+    verify(argparse.Namespace(first=first, second=second, progress='none'))
+    in_memory = capsys.readouterr().out
+    verify(argparse.Namespace(first=first, second=second, progress='none',
+                              memory_limit=0, tmpdir=str(tmp_path)))
+    assert capsys.readouterr().out == in_memory
+
+
+def test_repeated_relpaths_are_counted_and_reported(tmp_path):
+    first = create_temp_file(tmp_path, 'first.csv', HEADER + manifest_rows('/mnt/a', [
+        ('a.txt', 1, 'a'), ('a.txt', 1, 'a'), ('b.txt', 2, 'b')]))
+    second = create_temp_file(tmp_path, 'second.csv', HEADER + manifest_rows('/backup/b', [
+        ('a.txt', 1, 'a'), ('b.txt', 2, 'b'), ('a.txt', 3, 'c'), ('a.txt', 4, 'd')]))
+
+    report = tmp_path / 'report.json'
+    verify(argparse.Namespace(first=str(first), second=str(second), progress='none',
+                              report=str(report)))
+    result = json.loads(report.read_text())
+    assert (result['summary']['assets_a'], result['summary']['assets_b']) == (3, 4)
+    # the first a.txt in B matches, and each of the others is reported
+    assert result['summary']['unchanged'] == 2
+    assert [(d['status'], d['relpath'], d['bytes_b']) for d in result['differences']] == \
+        [('added', 'a.txt', 3), ('added', 'a.txt', 4)]
+
+
+def test_external_verify_matches_in_memory_with_repeated_relpaths(tmp_path):
+    rng = random.Random(0)
+    for case in range(50):
+        manifests = []
+        for side, root in enumerate(['/mnt/a', '/backup/b']):
+            files = [(rng.choice('abcde') + '.txt', rng.randint(1, 3), rng.choice('xyz'))
+                     for n in range(rng.randint(1, 8))]
+            manifests.append(str(create_temp_file(tmp_path, f'{side}.csv', HEADER + manifest_rows(root, files))))
+
+        results = []
+        for memory_limit in [None, 1]:
+            report = tmp_path / 'report.json'
+            verify(argparse.Namespace(first=manifests[0], second=manifests[1], progress='none',
+                                      report=str(report), memory_limit=memory_limit))
+            result = json.loads(report.read_text())
+            results.append((result['summary'], sorted(json.dumps(d) for d in result['differences'])))
+        assert results[0] == results[1]
@@ -0,0 +1,57 @@
+import json
+
+import pytest
+
+from preserve.writer import InventoryWriter, journal_path, recover
+
+
+def write_rows(path, rows, **kwargs):
+    handle = open(path, 'w')
+    writer = InventoryWriter(handle, ['PATH', 'BYTES'], path=str(path), **kwargs)
+    writer.writeheader()
+    for n in range(rows):
+        writer.writerow({'PATH': f'/data/file{n}', 'BYTES': n})
+    return writer
+
+
+def test_checkpoints_are_recorded_in_the_journal(tmp_path):
+    outfile = tmp_path / 'inventory.csv'
+    writer = write_rows(outfile, 5, max_rows=2)
+
+    journal = json.loads(open(journal_path(outfile)).read())
+    assert journal['rows'] == 4
+    assert journal['bytes'] == outfile.stat().st_size
+
+    writer.close()
+    assert len(outfile.read_text().splitlines()) == 6
+    assert not (tmp_path / 'inventory.csv.journal').exists()
+
+
+def test_header_is_written_at_once(tmp_path):
+    outfile = tmp_path / 'inventory.csv'
+    write_rows(outfile, 1)
+
+    assert outfile.read_text() == 'PATH,BYTES\n'
+    assert json.loads(open(journal_path(outfile)).read())['rows'] == 0
+
+
+def test_recover_removes_incomplete_row_after_checkpoint(tmp_path):
+    outfile = tmp_path / 'inventory.csv'
+    write_rows(outfile, 4, max_rows=2)
+    complete = outfile.read_bytes()
+
+    with open(outfile, 'ab') as handle:
+        handle.write(b'/data/torn,')
+    assert recover(outfile) == len(b'/data/torn,')
+    assert outfile.read_bytes() == complete
+    assert recover(outfile) == 0
+
+
+def test_recover_rejects_file_shorter_than_checkpoint(tmp_path):
+    outfile = tmp_path / 'inventory.csv'
+    write_rows(outfile, 4, max_rows=2)
+    with open(outfile, 'rb+') as handle:
+        handle.truncate(10)
+
+    with pytest.raises(ValueError):
+        recover(outfile)